@@ -0,0 +1,539 @@
+# Offline benchmark for genereate_to_gsheet.get_top_news and generate_by_o1.main.
+# The real pipelines run against local stand-ins: an HTTP server for the Google News feed, the publisher
+# pages and NewsAPI, and in-process fakes for Anthropic, YouTube, Sheets and the BART pipeline.
+# Every fake has configurable latency and failure rate, so runs need no network or credentials.
+#
+#   python benchmark.py --articles 20 --workers 8 --llm-latency-ms 400 --failure-rate 0.05
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+
+# API keys the clients insist on; the scripts' other settings come from the pins below
+os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark")
+os.environ.setdefault("YOUTUBE_API_KEY", "benchmark")
+os.environ.setdefault("NEWS_API", "benchmark")
+
+import genereate_to_gsheet
+import generate_by_o1
+
+# Both scripts read their settings from the environment (and .env) at import. Every setting that changes
+# what a run does is pinned to its default here, so a configured host still benchmarks the local fakes
+# with the same pipeline; scenarios override on top of these.
+GSHEET_SETTINGS = {
+    'NEWS_FEEDS': '',
+    'NEWS_API_PAGES': 1,
+    'NEWS_API_PAGE_SIZE': 10,
+    'FEED_RANK_K': 60,
+    'MAX_WORKERS': 4,
+    'CLASSIFY_BATCH_SIZE': 20,
+    'RUN_REPORT_DIR': '',
+    'PROMETHEUS_TEXTFILE': '',
+    'CACHE_TTL_SECONDS': 24 * 60 * 60,
+    'CACHE_MAX_ENTRIES': 5000,
+    'YOUTUBE_CACHE_TTL_SECONDS': 3 * 24 * 60 * 60,
+    'YOUTUBE_SIMILARITY_THRESHOLD': 0.75,
+    'HTTP_CONNECT_TIMEOUT': 5.0,
+    'HTTP_READ_TIMEOUT': 20.0,
+    'HTTP_RETRIES': 3,
+    'ARTICLE_CHAR_BUDGET': 2000,
+    'ARTICLE_BYTE_BUDGET': 2 * 1024 * 1024,
+    'SPREADSHEET_ID': 'benchmark',
+    'SHEET_NAME': 'Sheet1',
+    'SHEET_CHUNK_ROWS': 100,
+    'SHEET_FLUSH_EVERY': 0,
+    'STREAMING_MODE': False,
+    'INCREMENTAL_MODE': False,
+    'STORY_DEDUP': True,
+    'STORY_SIMILARITY_THRESHOLD': 0.5,
+    'RESUME_MAX_AGE_SECONDS': 6 * 60 * 60,
+    'RESUME_MAX_ATTEMPTS': 3
+}
+O1_SETTINGS = {
+    'NEWS_API_COUNTRIES': ['us'],
+    'NEWS_API_PAGES': 1,
+    'NEWS_API_PAGE_SIZE': 10,
+    'SUMMARY_BATCH_SIZE': 8,
+    'CHUNK_MAX_TOKENS': 1000,
+    'CHUNK_OVERLAP_SENTENCES': 0
+}
+
+
+class FakeAPIError(Exception):
+    pass
+
+
+class Fake:
+    # Shared latency/failure behaviour of the in-process fakes
+    def __init__(self, latency, failure_rate, rng):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = rng
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def call(self, extra_latency=0.0):
+        with self._lock:
+            self.calls += 1
+            failed = self.rng.random() < self.failure_rate
+        time.sleep(self.latency + extra_latency)
+        if failed:
+            raise FakeAPIError(f"{type(self).__name__} injected failure")
+
+
+class FakeAnthropic(Fake):
+    def __init__(self, latency, failure_rate, rng, seconds_per_output_token=0.0):
+        super().__init__(latency, failure_rate, rng)
+        self.seconds_per_output_token = seconds_per_output_token
+        self.messages = self
+
+    def create(self, **kwargs):
+        prompt = kwargs['messages'][-1]['content']
+        if kwargs.get('tools'):
+            text = None
+            tool_input = {
+                "summary": "A summary of the article. " * 40,
+                "hashtag": "#Benchmark",
+                "educational_content": "Some background on the topic. " * 30,
+                "entity_summaries": "Benchmark City: a place used for testing.",
+                "youtube_search_phrase": " ".join(re.findall(r'\w+', prompt)[12:15]) or "benchmark news",
+                "title": "A Catchy Benchmark Title"
+            }
+        elif "Are these news articles political?" in prompt:
+            count = len(re.findall(r'^\d+\. Title:', prompt, re.MULTILINE))
+            # Every fifth item is political, so the filter has something to drop
+            text = json.dumps({str(n): n % 5 == 0 for n in range(1, count + 1)})
+        elif "Is this news article political?" in prompt:
+            text = "False"
+        else:
+            text = "A generated blog post paragraph. " * 150
+
+        output_tokens = min(kwargs.get('max_tokens', 1000), len((text or json.dumps(tool_input)).split()) * 2)
+        self.call(output_tokens * self.seconds_per_output_token)
+        if text is None:
+            content = [SimpleNamespace(type='tool_use', name=kwargs['tools'][0]['name'], input=tool_input)]
+        else:
+            content = [SimpleNamespace(type='text', text=text)]
+        usage = SimpleNamespace(input_tokens=len(prompt) // 4, output_tokens=output_tokens)
+        return SimpleNamespace(content=content, usage=usage)
+
+    @contextlib.contextmanager
+    def stream(self, **kwargs):
+        # The whole response is produced up front; chunks then arrive as a text stream would deliver them
+        message = self.create(**kwargs)
+        text = message.content[0].text
+        yield SimpleNamespace(text_stream=(text[i:i + 40] for i in range(0, len(text), 40)),
+                              get_final_message=lambda: message)
+
+
+class FakeRequest:
+    def __init__(self, fake, result):
+        self.fake = fake
+        self.result = result
+
+    def execute(self, **kwargs):
+        self.fake.call()
+        return self.result() if callable(self.result) else self.result
+
+
+class FakeYouTube(Fake):
+    def search(self):
+        return self
+
+    def list(self, q, **kwargs):
+        video_id = f"vid{abs(hash(q)) % 100000:05d}"
+        return FakeRequest(self, {'items': [
+            {'id': {'videoId': video_id}, 'snippet': {'title': f"Video about {q}", 'description': ""}}
+        ]})
+
+
+class FakeSheets(Fake):
+    def __init__(self, latency, failure_rate, rng):
+        super().__init__(latency, failure_rate, rng)
+        self.rows = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, range, **kwargs):
+        column = 5 if range.endswith('F:F') else 0
+        return FakeRequest(self, lambda: {'values': [[row[column]] for row in self.rows if len(row) > column]})
+
+    def update(self, body, **kwargs):
+        return FakeRequest(self, lambda: self.rows.extend(body['values']) or {})
+
+    def append(self, body, **kwargs):
+        return self.update(body)
+
+
+class FakeTokenizer:
+    def __call__(self, texts, add_special_tokens=True):
+        if isinstance(texts, str):
+            return {'input_ids': texts.split()}
+        return {'input_ids': [text.split() for text in texts]}
+
+    def decode(self, ids):
+        return ' '.join(ids)
+
+
+class FakeSummarizer:
+    # Cost model of one forward pass: a fixed overhead plus a per-chunk cost
+    def __init__(self, seconds_per_pass, seconds_per_chunk):
+        self.seconds_per_pass = seconds_per_pass
+        self.seconds_per_chunk = seconds_per_chunk
+        self.tokenizer = FakeTokenizer()
+        self.passes = 0
+
+    def __call__(self, inputs, batch_size=1, **kwargs):
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        for start in range(0, len(inputs), batch_size):
+            self.passes += 1
+            time.sleep(self.seconds_per_pass + self.seconds_per_chunk * len(inputs[start:start + batch_size]))
+        return [{'summary_text': ' '.join(text.split()[:30])} for text in inputs]
+
+
+def article_page(index, size_kb):
+    boilerplate = (
+        "<script>var tracking = '" + "x" * 2000 + "';</script>"
+        "<nav><p>Home | World | Business | Sports | Weather | Subscribe to our newsletter today</p></nav>"
+    )
+    paragraph = f"<p>Story {index} paragraph with enough words to count as real article body text for the extractor.</p>"
+    body = paragraph * max(1, (size_kb * 1024 - len(boilerplate)) // len(paragraph))
+    return f"<html><head><title>Story {index}</title>{boilerplate}</head><body><article>{body}</article><footer><p>Copyright</p></footer></body></html>"
+
+
+def rss_feed(base_url, count):
+    # Every fourth item is another outlet's coverage of the story before it
+    stories = [n - 1 if n % 4 == 3 else n for n in range(count)]
+    items = "".join(
+        f"<item><title>Benchmark story {story} - Outlet {n % 3}</title><source>Outlet {n % 3}</source>"
+        f"<link>{base_url}/redirect/{n}</link>"
+        f"<description>Description of benchmark story {story}.</description></item>"
+        for n, story in enumerate(stories)
+    )
+    return f'<?xml version="1.0"?><rss version="2.0"><channel><title>Benchmark</title>{items}</channel></rss>'
+
+
+class FakeWebHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type, headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The extractor hangs up once it has read enough of a page
+
+    def do_GET(self):
+        config = self.server.config
+        time.sleep(config.http_latency)
+        with self.server.lock:
+            failed = self.server.rng.random() < config.failure_rate
+        if failed:
+            self.send_body(503, "unavailable", 'text/plain')
+            return
+
+        base_url = f"http://127.0.0.1:{self.server.server_port}"
+        path = self.path.split('?')[0]
+        if path == '/rss':
+            self.send_body(200, rss_feed(base_url, config.feed_items), 'application/rss+xml')
+        elif path.startswith('/redirect/'):
+            self.send_body(302, "", 'text/plain', {'Location': f"{base_url}/article/{path.rsplit('/', 1)[1]}"})
+        elif path.startswith('/article/'):
+            self.send_body(200, article_page(path.rsplit('/', 1)[1], config.page_kb), 'text/html')
+        elif path == '/newsapi':
+            articles = [
+                {
+                    'title': f"Benchmark story {n}",
+                    'url': f"{base_url}/article/{n}",
+                    'description': f"Description of benchmark story {n}.",
+                    'content': "A sentence of article content for the summarizer to work through. " * config.content_sentences
+                }
+                for n in range(config.articles)
+            ]
+            self.send_body(200, json.dumps({'status': 'ok', 'articles': articles}), 'application/json')
+        else:
+            self.send_body(404, "not found", 'text/plain')
+
+
+class FakeWebServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing pooled or half-read connections is expected, not an error
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+def start_fake_web(config, rng):
+    server = FakeWebServer(('127.0.0.1', 0), FakeWebHandler)
+    server.config = config
+    server.rng = rng
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(run):
+    # Returns wall time, peak traced memory and whatever run() returns
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = run()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def bench_gsheet(name, config, base_url, overrides, resume=False):
+    rng = random.Random(config.seed)
+    anthropic_fake = FakeAnthropic(config.llm_latency, config.failure_rate, rng, config.llm_seconds_per_token)
+    youtube_fake = FakeYouTube(config.youtube_latency, config.failure_rate, rng)
+    sheets_fake = FakeSheets(config.sheets_latency, 0.0, rng)
+    module = genereate_to_gsheet
+
+    patches = {
+        **GSHEET_SETTINGS,
+        'GOOGLE_NEWS_RSS_URL': f"{base_url}/rss",
+        'CACHE_DIR': tempfile.mkdtemp(prefix='news-bench-'),
+        'NEWS_COUNT': config.articles,
+        'get_anthropic_client': lambda: anthropic_fake,
+        'get_youtube_service': lambda: youtube_fake,
+        'get_google_sheets_service': lambda: sheets_fake,
+        'request_scheduler': module.RequestScheduler({
+            'anthropic': (config.anthropic_rpm, config.anthropic_tpm),
+            'youtube': (config.youtube_rpm, 0)
+        }),
+        **overrides
+    }
+    with mock.patch.multiple(module, **patches):
+        # Start every scenario with a cold cache and a fresh connection pool
+        module.get_result_cache.cache_clear()
+        module.get_youtube_search_cache.cache_clear()
+        module.get_http_session.cache_clear()
+        elapsed, peak, _ = measure(lambda: module.get_top_news(resume))
+        report = module.run_metrics.report()
+        module.get_result_cache.cache_clear()
+        module.get_youtube_search_cache.cache_clear()
+        module.get_http_session.cache_clear()
+
+    latencies = [article['seconds'] for article in report['articles'].values()]
+    return {
+        'pipeline': 'genereate_to_gsheet',
+        'scenario': name,
+        'articles': len(sheets_fake.rows),
+        'seconds': round(elapsed, 3),
+        'articles_per_min': round(len(sheets_fake.rows) / elapsed * 60, 1) if elapsed else 0.0,
+        'p50_article_seconds': round(percentile(latencies, 0.5), 3),
+        'p95_article_seconds': round(percentile(latencies, 0.95), 3),
+        'peak_memory_mb': round(peak / 1024 / 1024, 2),
+        'llm_calls': anthropic_fake.calls,
+        'youtube_calls': youtube_fake.calls,
+        'sheets_calls': sheets_fake.calls
+    }
+
+
+def bench_o1(name, config, base_url, overrides):
+    rng = random.Random(config.seed)
+    summarizer = FakeSummarizer(config.summarizer_pass_latency, config.summarizer_chunk_latency)
+    youtube_fake = FakeYouTube(config.youtube_latency, config.failure_rate, rng)
+    module = generate_by_o1
+
+    finished = []
+
+    def create_blog_post(*args, **kwargs):
+        finished.append(time.perf_counter() - start)
+        return original_create_blog_post(*args, **kwargs)
+
+    original_create_blog_post = module.create_blog_post
+    patches = {
+        **O1_SETTINGS,
+        'NEWS_API_URL': f"{base_url}/newsapi",
+        'get_summarizer': lambda: summarizer,
+        'inference_context': contextlib.nullcontext,
+        'get_youtube_service': lambda api_key: youtube_fake,
+        'create_blog_post': create_blog_post,
+        **overrides
+    }
+    with mock.patch.multiple(module, **patches):
+        start = time.perf_counter()
+        elapsed, peak, _ = measure(module.main)
+
+    # Per-article latency here is the time from the start of the run until the article's post is ready
+    return {
+        'pipeline': 'generate_by_o1',
+        'scenario': name,
+        'articles': len(finished),
+        'seconds': round(elapsed, 3),
+        'articles_per_min': round(len(finished) / elapsed * 60, 1) if elapsed else 0.0,
+        'p50_article_seconds': round(percentile(finished, 0.5), 3),
+        'p95_article_seconds': round(percentile(finished, 0.95), 3),
+        'peak_memory_mb': round(peak / 1024 / 1024, 2),
+        'summarizer_passes': summarizer.passes,
+        'youtube_calls': youtube_fake.calls
+    }
+
+
+def gsheet_scenarios(config):
+    return [
+        ('sequential', {'MAX_WORKERS': 1, 'CLASSIFY_BATCH_SIZE': 1}),
+        ('concurrent', {'MAX_WORKERS': config.workers}),
+        ('streaming', {'MAX_WORKERS': config.workers, 'STREAMING_MODE': True})
+    ]
+
+
+def bench_gsheet_resumed(config, base_url):
+    # An interrupted run, then the measured run resuming it. The first pass finds no videos, falls back on
+    # the first article's summary and dies after every blog post, before any row is spooled; the resumed
+    # pass must write every article, redoing only the summary and post of the first one.
+    module = genereate_to_gsheet
+    cache_dir = tempfile.mkdtemp(prefix='news-bench-')
+    first_link = f"{base_url}/redirect/0"
+    summarize_article = module.summarize_article
+
+    def summary_fails_once(title, link):
+        if link == first_link:
+            return {"summary": module.SUMMARY_FALLBACK, "hashtag": "#News", "educational_content": "",
+                    "entity_summaries": "", "youtube_search_phrase": "", "title": title}
+        return summarize_article(title, link)
+
+    def interrupted(row, sheet_name=None):
+        raise RuntimeError("interrupted")
+
+    bench_gsheet('interrupted', config, base_url, {
+        'CACHE_DIR': cache_dir,
+        'summarize_article': summary_fails_once,
+        'search_youtube_video': lambda phrase: (None, None, None),
+        'spool_row': interrupted
+    })
+    result = bench_gsheet('resumed', config, base_url, {'CACHE_DIR': cache_dir}, resume=True)
+    if not config.failure_rate and (result['articles'] != config.articles or result['llm_calls'] != 2):
+        raise RuntimeError(f"Resumed run wrote {result['articles']} of {config.articles} articles "
+                           f"with {result['llm_calls']} Anthropic calls (expected 2)")
+    return result
+
+
+def o1_scenarios(config):
+    return [
+        ('unbatched', {'SUMMARY_BATCH_SIZE': 1}),
+        ('batched', {'SUMMARY_BATCH_SIZE': config.batch_size})
+    ]
+
+
+def print_results(results):
+    columns = ('pipeline', 'scenario', 'articles', 'seconds', 'articles_per_min',
+               'p50_article_seconds', 'p95_article_seconds', 'peak_memory_mb')
+    headers = ('Pipeline', 'Scenario', 'Articles', 'Seconds', 'Art/min', 'p50 s', 'p95 s', 'Peak MB')
+    widths = [max(len(header), *(len(str(result[column])) for result in results)) for header, column in zip(headers, columns)]
+    print("  ".join(header.ljust(width) for header, width in zip(headers, widths)))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the news pipelines against local fakes.")
+    parser.add_argument('--articles', type=int, default=10, help="articles per run")
+    parser.add_argument('--feed-items', type=int, default=0, help="RSS items in the fake feed (default: 3x articles)")
+    parser.add_argument('--workers', type=int, default=4, help="MAX_WORKERS for the concurrent scenario")
+    parser.add_argument('--batch-size', type=int, default=8, help="SUMMARY_BATCH_SIZE for the batched o1 scenario")
+    parser.add_argument('--page-kb', type=int, default=200, help="size of each fake publisher page")
+    parser.add_argument('--content-sentences', type=int, default=200, help="sentences per NewsAPI article")
+    parser.add_argument('--http-latency-ms', type=float, default=50)
+    parser.add_argument('--llm-latency-ms', type=float, default=300)
+    parser.add_argument('--llm-ms-per-token', type=float, default=0.0, help="extra Anthropic latency per output token")
+    parser.add_argument('--youtube-latency-ms', type=float, default=150)
+    parser.add_argument('--sheets-latency-ms', type=float, default=200)
+    parser.add_argument('--summarizer-pass-ms', type=float, default=200, help="fixed cost of one BART forward pass")
+    parser.add_argument('--summarizer-chunk-ms', type=float, default=50, help="extra cost per chunk in a pass")
+    parser.add_argument('--anthropic-rpm', type=int, default=0, help="scheduler requests/min limit for Anthropic (0 = unlimited)")
+    parser.add_argument('--anthropic-tpm', type=int, default=0, help="scheduler tokens/min limit for Anthropic (0 = unlimited)")
+    parser.add_argument('--youtube-rpm', type=int, default=0, help="scheduler requests/min limit for YouTube (0 = unlimited)")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="probability that any fake call fails")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skip-gsheet', action='store_true')
+    parser.add_argument('--skip-o1', action='store_true')
+    parser.add_argument('--json', metavar='PATH', help="also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    return SimpleNamespace(
+        articles=args.articles,
+        feed_items=args.feed_items or args.articles * 3,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        page_kb=args.page_kb,
+        content_sentences=args.content_sentences,
+        http_latency=args.http_latency_ms / 1000,
+        llm_latency=args.llm_latency_ms / 1000,
+        llm_seconds_per_token=args.llm_ms_per_token / 1000,
+        youtube_latency=args.youtube_latency_ms / 1000,
+        sheets_latency=args.sheets_latency_ms / 1000,
+        summarizer_pass_latency=args.summarizer_pass_ms / 1000,
+        summarizer_chunk_latency=args.summarizer_chunk_ms / 1000,
+        anthropic_rpm=args.anthropic_rpm,
+        anthropic_tpm=args.anthropic_tpm,
+        youtube_rpm=args.youtube_rpm,
+        failure_rate=args.failure_rate,
+        seed=args.seed,
+        skip_gsheet=args.skip_gsheet,
+        skip_o1=args.skip_o1,
+        json_path=args.json
+    )
+
+
+def main(argv=None):
+    config = parse_args(argv)
+    server = start_fake_web(config, random.Random(config.seed))
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    results = []
+    try:
+        if not config.skip_gsheet:
+            for name, overrides in gsheet_scenarios(config):
+                results.append(bench_gsheet(name, config, base_url, overrides))
+            results.append(bench_gsheet_resumed(config, base_url))
+        if not config.skip_o1:
+            for name, overrides in o1_scenarios(config):
+                results.append(bench_o1(name, config, base_url, overrides))
+    finally:
+        server.shutdown()
+
+    print_results(results)
+    if config.json_path:
+        with open(config.json_path, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,58 +1,186 @@
 import requests
-from transformers import pipeline
 from googleapiclient.discovery import build
 from dotenv import load_dotenv
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import os
-import torch
+import re
 
 load_dotenv()
 
-# Check if CUDA is available and set the device accordingly
-device = 0 if torch.cuda.is_available() else -1
+NEWS_API_URL = "https://newsapi.org/v2/top-headlines"
+# Countries whose top headlines are fetched, pages per country and articles per page (at most 100)
+NEWS_API_COUNTRIES = [country.strip() for country in os.getenv("NEWS_API_COUNTRIES", "us").split(',') if country.strip()] or ['us']
+NEWS_API_PAGES = max(1, int(os.getenv("NEWS_API_PAGES", "1")))
+NEWS_API_PAGE_SIZE = min(100, int(os.getenv("NEWS_API_PAGE_SIZE", "10")))
+# Seconds to wait for NewsAPI to accept the connection and to send the response
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "20"))
+MODEL_NAME = "facebook/bart-large-cnn"
+# Number of text chunks summarized per forward pass
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "8"))
+# CPU-only settings: intra-op thread count (0 keeps the torch default) and dynamic int8 quantization
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0"))
+QUANTIZE_MODEL = os.getenv("QUANTIZE_MODEL", "false").lower() == "true"
+# Token budget per chunk (BART accepts 1024 tokens including special tokens) and the number of
+# sentences repeated at the start of the next chunk to carry context across chunk boundaries
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "1000"))
+CHUNK_OVERLAP_SENTENCES = int(os.getenv("CHUNK_OVERLAP_SENTENCES", "0"))
 
-# Initialize the summarization pipeline
-summarizer = pipeline('summarization', model="facebook/bart-large-cnn", device=device)
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
 
-def split_text(text, max_chunk_length=500):
+@lru_cache(maxsize=None)
+def get_summarizer():
     """
-    Splits the text into chunks that the model can handle.
+    Builds the summarization pipeline on first use, tuned for CPU inference when no GPU is available.
+    torch and transformers are imported here so the module loads without them.
     """
-    sentences = text.split('. ')
+    import torch
+    from transformers import pipeline, AutoModelForSeq2SeqLM, AutoTokenizer
+
+    # Check if CUDA is available and set the device accordingly
+    device = 0 if torch.cuda.is_available() else -1
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_NAME)
+    model.eval()
+    if device == -1:
+        if TORCH_NUM_THREADS:
+            torch.set_num_threads(TORCH_NUM_THREADS)
+        if QUANTIZE_MODEL:
+            # Linear layers dominate BART's CPU time; int8 weights make them several times cheaper
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return pipeline('summarization', model=model, tokenizer=tokenizer, device=device)
+
+def inference_context():
+    """
+    Disables autograd bookkeeping for the summarizer's forward passes.
+    """
+    import torch
+    return torch.inference_mode()
+
+def split_text(text, tokenizer=None, max_tokens=CHUNK_MAX_TOKENS, overlap_sentences=CHUNK_OVERLAP_SENTENCES):
+    """
+    Splits the text into chunks of whole sentences that fit the model's token limit.
+    """
+    tokenizer = tokenizer or get_summarizer().tokenizer
+    sentences = [sentence for sentence in SENTENCE_BOUNDARY.split(text.strip()) if sentence]
+    if not sentences:
+        return []
+    # Every sentence is tokenized once, in one call; packing is then a single pass over the token counts
+    sentence_ids = tokenizer(sentences, add_special_tokens=False)['input_ids']
+
     chunks = []
-    current_chunk = ''
-    for sentence in sentences:
-        if len(current_chunk) + len(sentence) <= max_chunk_length:
-            current_chunk += sentence + '. '
-        else:
-            chunks.append(current_chunk)
-            current_chunk = sentence + '. '
-    if current_chunk:
-        chunks.append(current_chunk)
+    current = []
+    current_tokens = 0
+    for sentence, ids in zip(sentences, sentence_ids):
+        if len(ids) > max_tokens:
+            # A sentence longer than the budget is split on token boundaries
+            if current:
+                chunks.append(' '.join(part for part, _ in current))
+                current, current_tokens = [], 0
+            for start in range(0, len(ids), max_tokens):
+                chunks.append(tokenizer.decode(ids[start:start + max_tokens]))
+            continue
+
+        if current and current_tokens + len(ids) > max_tokens:
+            chunks.append(' '.join(part for part, _ in current))
+            current = current[-overlap_sentences:] if overlap_sentences else []
+            current_tokens = sum(count for _, count in current)
+            while current and current_tokens + len(ids) > max_tokens:
+                current_tokens -= current.pop(0)[1]
+
+        current.append((sentence, len(ids)))
+        current_tokens += len(ids)
+
+    if current:
+        chunks.append(' '.join(part for part, _ in current))
     return chunks
 
+def get_country_headlines(api_key, country):
+    """
+    Fetches up to NEWS_API_PAGES pages of the top headlines of one country from NewsAPI, stopping at
+    the first short page. Raises on HTTP errors and on error responses.
+    """
+    articles = []
+    for page in range(1, NEWS_API_PAGES + 1):
+        response = requests.get(NEWS_API_URL, params={
+            'country': country,
+            'pageSize': NEWS_API_PAGE_SIZE,
+            'page': page,
+            'apiKey': api_key
+        }, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        response.raise_for_status()
+        data = response.json()
+        if data.get('status') == 'error':
+            raise RuntimeError(data.get('message') or data.get('code'))
+        results = data.get('articles') or []
+        articles.extend(result for result in results if result.get('url'))
+        if len(results) < NEWS_API_PAGE_SIZE or page * NEWS_API_PAGE_SIZE >= data.get('totalResults', 0):
+            break
+    return articles
+
 def get_top_news(api_key):
     """
-    Fetches the top 10 Google News articles using the NewsAPI.
+    Fetches the top headlines of every country in NEWS_API_COUNTRIES from NewsAPI, all countries
+    at the same time and up to NEWS_API_PAGES pages each. The country lists are interleaved by rank
+    and articles listed more than once are kept only the first time.
     """
-    url = ('https://newsapi.org/v2/top-headlines?'
-           'country=us&'
-           'pageSize=10&'
-           f'apiKey={api_key}')
-    response = requests.get(url)
-    data = response.json()
-    articles = data['articles']
+    def fetch_country(country):
+        # A country that fails contributes nothing instead of failing the others
+        try:
+            return get_country_headlines(api_key, country)
+        except Exception as e:
+            print(f"Error: Unable to fetch news for {country}. {str(e)}")
+            return []
+
+    with ThreadPoolExecutor(max_workers=len(NEWS_API_COUNTRIES)) as executor:
+        country_articles = list(executor.map(fetch_country, NEWS_API_COUNTRIES))
+
+    articles = []
+    seen = set()
+    for rank in range(max(map(len, country_articles), default=0)):
+        for listing in country_articles:
+            if rank < len(listing) and listing[rank]['url'] not in seen:
+                seen.add(listing[rank]['url'])
+                articles.append(listing[rank])
     return articles
 
+def summarize_articles(contents, batch_size=None):
+    """
+    Summarizes several articles at once: the chunks of all articles go through the pipeline
+    in batches and the chunk summaries are joined back per article.
+    """
+    batch_size = batch_size or SUMMARY_BATCH_SIZE
+    chunks = []
+    owners = []
+    for index, content in enumerate(contents):
+        for chunk in split_text(content):
+            chunks.append(chunk)
+            owners.append(index)
+
+    # Batch chunks of similar length together so little time is spent on padding
+    order = sorted(range(len(chunks)), key=lambda i: len(chunks[i]), reverse=True)
+    chunk_summaries = [None] * len(chunks)
+    if chunks:
+        with inference_context():
+            results = get_summarizer()(
+                [chunks[i] for i in order],
+                max_length=150, min_length=40, do_sample=False, truncation=True, batch_size=batch_size
+            )
+        for i, result in zip(order, results):
+            chunk_summaries[i] = result['summary_text']
+
+    summaries = [[] for _ in contents]
+    for index, summary in zip(owners, chunk_summaries):
+        summaries[index].append(summary)
+    return [' '.join(parts) for parts in summaries]
+
 def summarize_article(content):
     """
     Summarizes the article content into a few paragraphs.
     """
-    chunks = split_text(content)
-    summaries = []
-    for chunk in chunks:
-        summary = summarizer(chunk, max_length=150, min_length=40, do_sample=False)[0]['summary_text']
-        summaries.append(summary)
-    return ' '.join(summaries)
+    return summarize_articles([content])[0]
 
 
 def rewrite_title(title):
@@ -79,11 +207,18 @@ def create_youtube_search_query(summary):
     search_query = ' '.join(words[:5])
     return search_query
 
+@lru_cache(maxsize=None)
+def get_youtube_service(api_key):
+    """
+    Builds the YouTube client once per API key instead of once per search.
+    """
+    return build('youtube', 'v3', developerKey=api_key, static_discovery=True)
+
 def search_youtube(query, api_key):
     """
     Searches for a related YouTube video and retrieves its link and title.
     """
-    youtube = build('youtube', 'v3', developerKey=api_key)
+    youtube = get_youtube_service(api_key)
     request = youtube.search().list(
         part='snippet',
         maxResults=1,
@@ -123,14 +258,26 @@ def main():
     youtube_api_key = os.getenv("YOUTUBE_API_KEY")
 
     articles = get_top_news(news_api_key)
+
+    pending = []
     for article in articles:
+        title = article['title']
+        content = article['content'] or article['description']
+        if not content:
+            print(f"No content available for article: {title}")
+            continue
+        pending.append((title, content))
+
+    # Summarize all articles in one batched pass; fall back to one article at a time if that fails
+    try:
+        summaries = summarize_articles([content for _, content in pending])
+    except Exception as e:
+        print(f"Batched summarization failed, summarizing articles one by one: {e}")
+        summaries = None
+
+    for index, (title, content) in enumerate(pending):
         try:
-            title = article['title']
-            content = article['content'] or article['description']
-            if not content:
-                print(f"No content available for article: {title}")
-                continue
-            summary = summarize_article(content)
+            summary = summaries[index] if summaries else summarize_article(content)
             rewritten_title = rewrite_title(title)
             educational_content = generate_educational_content(summary)
             search_query = create_youtube_search_query(summary)
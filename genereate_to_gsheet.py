@@ -1,17 +1,36 @@
 # TODO: Change this back to top 20 news articles later
 # get me the top 3 news from google search for the current date and for the United States.
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
+from lxml import etree
+import numpy as np
 from datetime import datetime
 import anthropic
 import os
 from dotenv import load_dotenv
 import json
-from openai import OpenAI
 from pathlib import Path
 import random
+import re
 import sys
-from googleapiclient.discovery import build
+import threading
+import time
+import hashlib
+import codecs
+import glob
+import heapq
+import itertools
+import sqlite3
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -20,16 +39,815 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 # This is the location in PythonAnywhere; remove it for local testing
 load_dotenv('/home/tudo/.env')
 
-# Initialize the Anthropic client
-anthropic_client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-# Initialize OpenAI client
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-# Initialize YouTube API client
-youtube = build('youtube', 'v3', developerKey=os.getenv("YOUTUBE_API_KEY"))
+# API clients are created on first use, so importing this module or a run with nothing to do stays cheap
+@lru_cache(maxsize=None)
+def get_anthropic_client():
+    # Retries are handled by request_scheduler so they respect the shared rate limits
+    return anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
+
+@lru_cache(maxsize=None)
+def get_openai_client():
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+GOOGLE_NEWS_RSS_URL = "https://news.google.com/rss?hl=en-US&gl=US&ceid=US:en"
+GOOGLE_NEWS_BASE_URL = "https://news.google.com/rss"
+NEWS_API_URL = "https://newsapi.org/v2/top-headlines"
+# Sheet tabs and the feeds that fill them: "Tab=source,source;Tab=source", where a source is
+# google[:LANG-REGION[:TOPIC]], newsapi[:COUNTRY[:CATEGORY]] or rss:URL. Unset: the US Google News feed into SHEET_NAME.
+NEWS_FEEDS = os.getenv("NEWS_FEEDS", "")
+# NewsAPI pages fetched per newsapi source and articles per page (at most 100)
+NEWS_API_PAGES = max(1, int(os.getenv("NEWS_API_PAGES", "1")))
+NEWS_API_PAGE_SIZE = min(100, int(os.getenv("NEWS_API_PAGE_SIZE", "10")))
+# Reciprocal rank fusion constant used to merge the feeds of a tab; larger values flatten the rank bonus
+FEED_RANK_K = int(os.getenv("FEED_RANK_K", "60"))
+
+# Number of articles processed at the same time by get_top_news (1 = sequential)
+MAX_WORKERS = max(1, int(os.getenv("MAX_WORKERS", "4")))
+# Number of non-political articles kept from the feed per run
+NEWS_COUNT = int(os.getenv("NEWS_COUNT", "10"))  # Per sheet tab. TODO: Change this back to 20 later
+# Number of RSS items classified together in one Anthropic request
+CLASSIFY_BATCH_SIZE = max(1, int(os.getenv("CLASSIFY_BATCH_SIZE", "20")))
+
+MODEL = "claude-3-sonnet-20240229"
+# Bump a prompt version whenever its prompt changes so results cached for the old prompt are not reused
+CLASSIFY_PROMPT_VERSION = "1"
+SUMMARY_PROMPT_VERSION = "3"
+
+# Tool the summarization call must use, so every field comes back as structured input instead of free text
+ARTICLE_CONTENT_TOOL = {
+    "name": "record_article_content",
+    "description": "Record the content generated for a news article.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "summary": {
+                "type": "string",
+                "description": "A brief 5-minute read summary of the article."
+            },
+            "hashtag": {
+                "type": "string",
+                "description": "A relevant hashtag for the article."
+            },
+            "educational_content": {
+                "type": "string",
+                "description": "Educational content related to key terms or concepts in the summary (2-3 paragraphs max)."
+            },
+            "entity_summaries": {
+                "type": "string",
+                "description": "Short summaries of any places, person names, company names, brand names, business names, sports club names, food names, device names, tool names, country names, region names, or geographical feature names mentioned in the summary."
+            },
+            "youtube_search_phrase": {
+                "type": "string",
+                "description": "A short phrase or a few keywords (1-5 words) that capture the main topic or focus of the article, suitable for a YouTube search."
+            },
+            "title": {
+                "type": "string",
+                "description": "The news title rewritten without citing any source, making it catchy and engaging."
+            }
+        },
+        "required": ["summary", "hashtag", "educational_content", "entity_summaries", "youtube_search_phrase", "title"]
+    }
+}
+
+# Per-provider quotas enforced by request_scheduler (0 disables a limit)
+ANTHROPIC_REQUESTS_PER_MINUTE = int(os.getenv("ANTHROPIC_REQUESTS_PER_MINUTE", "50"))
+ANTHROPIC_TOKENS_PER_MINUTE = int(os.getenv("ANTHROPIC_TOKENS_PER_MINUTE", "40000"))
+YOUTUBE_REQUESTS_PER_MINUTE = int(os.getenv("YOUTUBE_REQUESTS_PER_MINUTE", "60"))
+SCHEDULER_MAX_RETRIES = int(os.getenv("SCHEDULER_MAX_RETRIES", "5"))
+SCHEDULER_MAX_BACKOFF_SECONDS = 60
+# When callers wait for quota, lower numbers go first so blog posts are not starved by classification traffic
+STAGE_PRIORITIES = {'blog_post': 0, 'summarize': 1, 'youtube_search': 1, 'classification': 2}
+
+# Run report: JSON written to RUN_REPORT_DIR, plus an optional Prometheus textfile-collector file
+RUN_REPORT_DIR = os.getenv("RUN_REPORT_DIR", "")
+PROMETHEUS_TEXTFILE = os.getenv("PROMETHEUS_TEXTFILE", "")
+# USD per million tokens, used to estimate the Anthropic spend of a run
+ANTHROPIC_INPUT_COST_PER_MTOK = float(os.getenv("ANTHROPIC_INPUT_COST_PER_MTOK", "3"))
+ANTHROPIC_OUTPUT_COST_PER_MTOK = float(os.getenv("ANTHROPIC_OUTPUT_COST_PER_MTOK", "15"))
+
+# Local cache of classifications, article content and feed bodies shared across scheduled runs
+CACHE_DIR = os.getenv("CACHE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+# YouTube results are kept longer than the rest, since every search costs 100 units of the daily quota;
+# phrases whose normalized words overlap at least this much (Jaccard) reuse an earlier result
+YOUTUBE_CACHE_TTL_SECONDS = int(os.getenv("YOUTUBE_CACHE_TTL_SECONDS", str(3 * 24 * 60 * 60)))
+YOUTUBE_SIMILARITY_THRESHOLD = float(os.getenv("YOUTUBE_SIMILARITY_THRESHOLD", "0.75"))
+SEARCH_STOPWORDS = {'a', 'an', 'and', 'at', 'by', 'for', 'from', 'in', 'of', 'on', 'or', 'the', 'to', 'with', 'vs', 'news', 'latest', 'update', 'updates'}
+
+# HTTP settings shared by the RSS feed and publisher page fetches
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "20"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_USER_AGENT = "Mozilla/5.0 (compatible; AINewsContentGenerator/1.0)"
+
+# Article extraction stops once this much body text is collected or this many bytes are downloaded
+ARTICLE_CHAR_BUDGET = int(os.getenv("ARTICLE_CHAR_BUDGET", "2000"))
+ARTICLE_BYTE_BUDGET = int(os.getenv("ARTICLE_BYTE_BUDGET", str(2 * 1024 * 1024)))
+# Paragraphs shorter than this are usually captions, bylines or buttons rather than article text
+MIN_PARAGRAPH_CHARS = 40
+# Elements whose text is used when a page has no usable <p> paragraphs
+FALLBACK_BLOCK_TAGS = {'div', 'section', 'article', 'main', 'td', 'li', 'span'}
+# Elements whose text never belongs to the article body
+BOILERPLATE_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'iframe', 'nav', 'header', 'footer', 'aside', 'form', 'button', 'figure'}
+
+_thread_local = threading.local()
+
+class RunMetrics:
+    # Wall time, calls, errors, retries and Anthropic token usage per stage and per article; safe to share between threads
+    FIELDS = ('calls', 'seconds', 'errors', 'retries', 'input_tokens', 'output_tokens')
+
+    def __init__(self):
+        self.started_at = datetime.now()
+        self.stages = {}
+        self.articles = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _add(self, stage, **values):
+        article = getattr(self._local, 'article', None)
+        with self._lock:
+            targets = [self.stages.setdefault(stage, dict.fromkeys(self.FIELDS, 0))]
+            if article is not None:
+                article_stages = self.articles[article]['stages']
+                targets.append(article_stages.setdefault(stage, dict.fromkeys(self.FIELDS, 0)))
+            for target in targets:
+                for field, value in values.items():
+                    target[field] += value
+
+    @contextmanager
+    def stage(self, stage):
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._add(stage, calls=1, seconds=time.perf_counter() - start, errors=int(failed))
+
+    @contextmanager
+    def article(self, title):
+        # Stages recorded by this thread inside the block are also attributed to the article
+        with self._lock:
+            self.articles[title] = {'seconds': 0, 'stages': {}}
+        self._local.article = title
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.article = None
+            with self._lock:
+                self.articles[title]['seconds'] = time.perf_counter() - start
+
+    def record_usage(self, stage, response):
+        usage = getattr(response, 'usage', None)
+        if usage:
+            self._add(stage, input_tokens=usage.input_tokens or 0, output_tokens=usage.output_tokens or 0)
+
+    def record_retry(self, stage, count=1):
+        self._add(stage, retries=count)
+
+    def report(self):
+        with self._lock:
+            totals = {field: sum(stage[field] for stage in self.stages.values()) for field in self.FIELDS}
+            cost = (totals['input_tokens'] * ANTHROPIC_INPUT_COST_PER_MTOK
+                    + totals['output_tokens'] * ANTHROPIC_OUTPUT_COST_PER_MTOK) / 1_000_000
+            return {
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'duration_seconds': round(time.perf_counter() - self._start, 3),
+                'estimated_cost_usd': round(cost, 4),
+                'totals': totals,
+                'stages': json.loads(json.dumps(self.stages)),
+                'articles': json.loads(json.dumps(self.articles))
+            }
+
+    def emit(self):
+        report = self.report()
+
+        print(f"{'Stage':<16}{'Calls':>7}{'Seconds':>10}{'Errors':>8}{'Retries':>9}{'In tokens':>11}{'Out tokens':>12}")
+        for name, stage in sorted(report['stages'].items(), key=lambda item: -item[1]['seconds']):
+            print(f"{name:<16}{stage['calls']:>7}{stage['seconds']:>10.1f}{stage['errors']:>8}{stage['retries']:>9}"
+                  f"{stage['input_tokens']:>11}{stage['output_tokens']:>12}")
+        print(f"Run took {report['duration_seconds']:.1f}s for {len(report['articles'])} articles; "
+              f"estimated Anthropic cost ${report['estimated_cost_usd']:.4f}")
+
+        report_dir = RUN_REPORT_DIR or os.path.join(CACHE_DIR, "reports")
+        os.makedirs(report_dir, exist_ok=True)
+        report_path = os.path.join(report_dir, f"run-{self.started_at:%Y%m%d-%H%M%S}.json")
+        with open(report_path, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f"Run report written to {report_path}")
+
+        if PROMETHEUS_TEXTFILE:
+            self.write_prometheus_textfile(report, PROMETHEUS_TEXTFILE)
+        return report
+
+    @staticmethod
+    def write_prometheus_textfile(report, path):
+        lines = [
+            "# HELP news_run_duration_seconds Wall time of the last run.",
+            "# TYPE news_run_duration_seconds gauge",
+            f"news_run_duration_seconds {report['duration_seconds']}",
+            "# HELP news_run_articles Articles processed by the last run.",
+            "# TYPE news_run_articles gauge",
+            f"news_run_articles {len(report['articles'])}",
+            "# HELP news_run_estimated_cost_usd Estimated Anthropic spend of the last run.",
+            "# TYPE news_run_estimated_cost_usd gauge",
+            f"news_run_estimated_cost_usd {report['estimated_cost_usd']}"
+        ]
+        for field in RunMetrics.FIELDS:
+            lines.append(f"# HELP news_stage_{field} Per-stage {field.replace('_', ' ')} of the last run.")
+            lines.append(f"# TYPE news_stage_{field} gauge")
+            for name, stage in sorted(report['stages'].items()):
+                lines.append(f'news_stage_{field}{{stage="{name}"}} {stage[field]}')
+        # Write then rename so the textfile collector never reads a half-written file
+        with open(path + '.tmp', 'w') as textfile:
+            textfile.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+run_metrics = RunMetrics()
+
+class TokenBucket:
+    # Holds up to per_minute units and refills continuously; per_minute=0 means unlimited
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        if not self.capacity:
+            return 0
+        self.refill(now)
+        amount = min(amount, self.capacity)
+        return 0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        # May go negative when actual usage exceeds the estimate; later callers then wait longer
+        if self.capacity:
+            self.level = min(self.capacity, self.level - amount)
+
+class RequestScheduler:
+    # Per-provider requests/min and tokens/min token buckets shared by all worker threads. Callers waiting
+    # for quota are served by priority, then arrival; failed calls are retried with jittered backoff,
+    # and a provider's Retry-After pauses every caller of that provider.
+    def __init__(self, limits):
+        self._cond = threading.Condition()
+        self._buckets = {
+            provider: (TokenBucket(requests_per_minute), TokenBucket(tokens_per_minute))
+            for provider, (requests_per_minute, tokens_per_minute) in limits.items()
+        }
+        self._waiting = {}
+        self._paused_until = {}
+        self._arrivals = itertools.count()
+
+    def _wait_time(self, provider, tokens):
+        now = time.monotonic()
+        wait = max(0, self._paused_until.get(provider, 0) - now)
+        if provider in self._buckets:
+            requests, token_bucket = self._buckets[provider]
+            wait = max(wait, requests.wait_time(1, now), token_bucket.wait_time(tokens, now))
+        return wait
+
+    def acquire(self, provider, priority, tokens=0):
+        entry = (priority, next(self._arrivals))
+        with self._cond:
+            waiting = self._waiting.setdefault(provider, [])
+            heapq.heappush(waiting, entry)
+            try:
+                while True:
+                    # Only the first caller in line watches the buckets; the rest sleep until it is served
+                    wait = self._wait_time(provider, tokens) if waiting[0] == entry else None
+                    if wait == 0:
+                        heapq.heappop(waiting)
+                        if provider in self._buckets:
+                            requests, token_bucket = self._buckets[provider]
+                            requests.take(1)
+                            token_bucket.take(tokens)
+                        self._cond.notify_all()
+                        return
+                    self._cond.wait(timeout=wait)
+            except BaseException:
+                if entry in waiting:
+                    waiting.remove(entry)
+                    heapq.heapify(waiting)
+                    self._cond.notify_all()
+                raise
+
+    def record_tokens(self, provider, tokens):
+        # Charge the difference between a call's actual token usage and what acquire() reserved
+        with self._cond:
+            if provider in self._buckets:
+                self._buckets[provider][1].take(tokens)
+
+    def pause(self, provider, seconds):
+        with self._cond:
+            self._paused_until[provider] = max(self._paused_until.get(provider, 0), time.monotonic() + seconds)
+
+    def call(self, provider, request, priority=1, tokens=0, stage=None):
+        for attempt in range(SCHEDULER_MAX_RETRIES + 1):
+            self.acquire(provider, priority, tokens)
+            try:
+                return request()
+            except Exception as e:
+                status, retry_after = describe_api_error(e)
+                if status is None or attempt == SCHEDULER_MAX_RETRIES:
+                    raise
+                delay = min(SCHEDULER_MAX_BACKOFF_SECONDS, 2 ** attempt) * random.uniform(0.5, 1.5)
+                if retry_after is not None:
+                    delay = retry_after + random.uniform(0, 1)
+                if stage:
+                    run_metrics.record_retry(stage)
+                print(f"{provider} API error {status}; retrying in {delay:.1f}s...")
+                if status == 429:
+                    self.pause(provider, delay)
+                else:
+                    time.sleep(delay)
+
+def describe_api_error(error):
+    # Returns (status, retry_after_seconds) for errors worth retrying, (None, None) otherwise
+    if isinstance(error, anthropic.APIConnectionError):
+        return 'connection', None
+    if isinstance(error, anthropic.APIStatusError):
+        status = error.status_code
+        headers = error.response.headers
+    elif isinstance(error, HttpError):
+        status = error.resp.status
+        headers = error.resp
+        reason = str(error)
+        # Daily quota exhaustion (quotaExceeded) will not recover by retrying
+        if status == 403 and ('rateLimitExceeded' in reason or 'userRateLimitExceeded' in reason):
+            status = 429
+    else:
+        return None, None
+    if status not in (429, 500, 502, 503, 504, 529):
+        return None, None
+    try:
+        retry_after = float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        retry_after = None
+    return status, retry_after
+
+request_scheduler = RequestScheduler({
+    'anthropic': (ANTHROPIC_REQUESTS_PER_MINUTE, ANTHROPIC_TOKENS_PER_MINUTE),
+    'youtube': (YOUTUBE_REQUESTS_PER_MINUTE, 0)
+})
+
+def estimate_input_tokens(kwargs):
+    # Roughly four characters per token, which is close enough for rate limiting
+    text = kwargs.get('system', '') + ''.join(str(message['content']) for message in kwargs.get('messages', []))
+    return len(text) // 4 + 1
+
+def create_message(stage, **kwargs):
+    # Every Anthropic call goes through here: request_scheduler applies the rate limits and retries,
+    # and the call's time and token usage are recorded against the stage
+    estimate = estimate_input_tokens(kwargs)
+
+    def send():
+        with run_metrics.stage(stage):
+            return get_anthropic_client().messages.create(**kwargs)
+
+    response = request_scheduler.call('anthropic', send, STAGE_PRIORITIES.get(stage, 1), estimate, stage)
+    run_metrics.record_usage(stage, response)
+    usage = getattr(response, 'usage', None)
+    if usage:
+        request_scheduler.record_tokens('anthropic', (usage.input_tokens or 0) + (usage.output_tokens or 0) - estimate)
+    return response
+
+def stream_message(stage, spool_file, **kwargs):
+    # Like create_message, but the text is appended to spool_file as it streams in. Text already in the
+    # spool (from a failed attempt or an interrupted run) is sent back as the start of the assistant turn,
+    # so generation continues where it stopped. Returns the full text.
+    # The spool is keyed on the request as well, so only an identical prompt ever continues from it.
+    spool_file = f"{spool_file}.{hashlib.sha1(json.dumps(kwargs, sort_keys=True).encode('utf-8')).hexdigest()[:12]}"
+    estimate = estimate_input_tokens(kwargs)
+
+    def send():
+        prefix = ''
+        if os.path.exists(spool_file):
+            with open(spool_file) as spool:
+                prefix = spool.read().rstrip()  # The API rejects a prefill ending in whitespace
+        messages = kwargs['messages'] + ([{"role": "assistant", "content": prefix}] if prefix else [])
+        chunks = [prefix]
+        with run_metrics.stage(stage), open(spool_file, 'w') as spool:
+            spool.write(prefix)
+            with get_anthropic_client().messages.stream(**{**kwargs, 'messages': messages}) as stream:
+                for text in stream.text_stream:
+                    spool.write(text)
+                    spool.flush()
+                    chunks.append(text)
+                message = stream.get_final_message()
+        return ''.join(chunks), message
+
+    text, message = request_scheduler.call('anthropic', send, STAGE_PRIORITIES.get(stage, 1), estimate, stage)
+    run_metrics.record_usage(stage, message)
+    usage = getattr(message, 'usage', None)
+    if usage:
+        request_scheduler.record_tokens('anthropic', (usage.input_tokens or 0) + (usage.output_tokens or 0) - estimate)
+    return text
+
+@lru_cache(maxsize=None)
+def get_discovery_document(name, version):
+    # Discovery documents ship with google-api-python-client; read and parse each one once per process
+    document = get_static_doc(name, version)
+    return json.loads(document) if document else None
+
+def build_google_service(name, version, **kwargs):
+    document = get_discovery_document(name, version)
+    if document is None:
+        return build(name, version, cache_discovery=False, **kwargs)
+    return build_from_document(document, **kwargs)
+
+def get_youtube_service():
+    # googleapiclient service objects are not thread-safe, so every worker thread builds its own
+    if not hasattr(_thread_local, 'youtube'):
+        _thread_local.youtube = build_google_service('youtube', 'v3', developerKey=os.getenv("YOUTUBE_API_KEY"))
+    return _thread_local.youtube
 
 # Google Sheets API setup
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 SPREADSHEET_ID = os.getenv("GOOGLE_SPREADSHEET_ID")
+SHEET_NAME = os.getenv("SHEET_NAME", "Sheet1")
+# Rows sent per Sheets write request
+SHEET_CHUNK_ROWS = int(os.getenv("SHEET_CHUNK_ROWS", "100"))
+# Write to the sheet every N finished rows so partial results survive a crash (0 = one write at the end of the run)
+SHEET_FLUSH_EVERY = int(os.getenv("SHEET_FLUSH_EVERY", "0"))
+SHEET_WRITE_RETRIES = 5
+# Stream blog posts into the spool as they are generated and write each row to the sheet as soon as its
+# article is done, in completion order rather than feed order
+STREAMING_MODE = os.getenv("STREAMING_MODE", "false").lower() == "true"
+# Skip articles whose link or title was already written to the sheet by an earlier run
+INCREMENTAL_MODE = os.getenv("INCREMENTAL_MODE", "false").lower() == "true"
+# Group feed items covering the same story and process only the highest-ranked one of each group
+STORY_DEDUP = os.getenv("STORY_DEDUP", "true").lower() == "true"
+# TF-IDF cosine similarity of titles and descriptions above which two items are the same story
+STORY_SIMILARITY_THRESHOLD = float(os.getenv("STORY_SIMILARITY_THRESHOLD", "0.5"))
+# Continue the last unfinished run from each article's last completed stage (also: --resume)
+RESUME_MODE = os.getenv("RESUME_MODE", "false").lower() == "true"
+# Runs older than this, or already resumed this many times, are abandoned and a new run starts instead
+RESUME_MAX_AGE_SECONDS = int(os.getenv("RESUME_MAX_AGE_SECONDS", str(6 * 60 * 60)))
+RESUME_MAX_ATTEMPTS = int(os.getenv("RESUME_MAX_ATTEMPTS", "3"))
+# Per-article stages recorded in the run state store, in order
+ARTICLE_STAGES = ('fetched', 'classified', 'summarized', 'titled', 'video', 'post', 'written')
+SUMMARY_FALLBACK = "Unable to generate summary."
+BLOG_POST_FALLBACK = "Unable to generate blog post."
+
+def canonicalize_url(url):
+    # Drop tracking parameters, fragments and trailing slashes so the same story maps to one cache key
+    parts = urlsplit(url.strip())
+    query = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_') and key not in ('oc', 'hl', 'gl', 'ceid')
+    ]
+    return urlunsplit((
+        parts.scheme.lower(),
+        parts.netloc.lower(),
+        parts.path.rstrip('/') or '/',
+        urlencode(sorted(query)),
+        ''
+    ))
+
+class ResultCache:
+    # SQLite-backed cache with TTL and size-based (least recently used) eviction, safe to share between threads
+    def __init__(self, path, ttl_seconds=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, namespace_ttls=None):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.namespace_ttls = namespace_ttls or {}
+        self.max_entries = max_entries
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, namespace TEXT NOT NULL, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(namespace, parts):
+        return hashlib.sha256(json.dumps([namespace, *parts]).encode('utf-8')).hexdigest()
+
+    def ttl_for(self, namespace):
+        return self.namespace_ttls.get(namespace, self.ttl_seconds)
+
+    def get(self, namespace, *parts):
+        key = self.make_key(namespace, parts)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_for(namespace))
+            ).fetchone()
+            if row is None:
+                self.misses[namespace] += 1
+                return None
+            self.hits[namespace] += 1
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, namespace, value, *parts):
+        key = self.make_key(namespace, parts)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, namespace, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, namespace, json.dumps(value), now, now)
+            )
+            self._conn.commit()
+
+    def values(self, namespace):
+        # Every unexpired value in the namespace, without touching hit/miss counts or access times
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT value FROM cache WHERE namespace = ? AND created_at >= ?",
+                (namespace, time.time() - self.ttl_for(namespace))
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def evict(self):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"DELETE FROM cache WHERE created_at < ? AND namespace NOT IN ({', '.join('?' * len(self.namespace_ttls))})",
+                (now - self.ttl_seconds, *self.namespace_ttls)
+            )
+            for namespace, ttl in self.namespace_ttls.items():
+                self._conn.execute("DELETE FROM cache WHERE namespace = ? AND created_at < ?", (namespace, now - ttl))
+            self._conn.execute(
+                "DELETE FROM cache WHERE key NOT IN (SELECT key FROM cache ORDER BY accessed_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def report(self):
+        for namespace in sorted(set(self.hits) | set(self.misses)):
+            hits, misses = self.hits[namespace], self.misses[namespace]
+            print(f"Cache {namespace}: {hits} hits, {misses} misses ({hits / (hits + misses):.0%} hit rate)")
+
+@lru_cache(maxsize=None)
+def get_result_cache():
+    return ResultCache(os.path.join(CACHE_DIR, "results.sqlite3"), namespace_ttls={'youtube': YOUTUBE_CACHE_TTL_SECONDS})
+
+def search_phrase_tokens(phrase):
+    return frozenset(word for word in re.findall(r'\w+', phrase.lower()) if word not in SEARCH_STOPWORDS)
+
+class YouTubeSearchCache:
+    # Looks up YouTube results by normalized search phrase: exact and near-duplicate phrases reuse a cached
+    # result, and threads asking for the same phrase at the same time share one API call
+    def __init__(self, result_cache, threshold=YOUTUBE_SIMILARITY_THRESHOLD):
+        self.result_cache = result_cache
+        self.threshold = threshold
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._entries = None
+
+    def find(self, tokens, key):
+        if self._entries is None:
+            self._entries = {entry['key']: entry for entry in self.result_cache.values('youtube')}
+        if key in self._entries:
+            self.stats['exact'] += 1
+            return self._entries[key]['result']
+        best, best_score = None, 0
+        for entry in self._entries.values():
+            other = frozenset(entry['tokens'])
+            score = len(tokens & other) / len(tokens | other)
+            if score > best_score:
+                best, best_score = entry, score
+        if best and best_score >= self.threshold:
+            self.stats['similar'] += 1
+            return best['result']
+        return None
+
+    def lookup(self, phrase, search):
+        tokens = search_phrase_tokens(phrase)
+        if not tokens:
+            return search(phrase)
+        key = ' '.join(sorted(tokens))
+
+        with self._lock:
+            result = self.find(tokens, key)
+            if result is not None:
+                return tuple(result)
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+                self.stats['searched'] += 1
+            else:
+                self.stats['shared'] += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = search(phrase)
+        except Exception as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        # Published and no longer in flight in one step, so no thread can miss both and search again
+        entry = {'key': key, 'tokens': sorted(tokens), 'result': list(result)}
+        with self._lock:
+            self._entries[key] = entry
+            del self._in_flight[key]
+        self.result_cache.set('youtube', entry, key)
+        future.set_result(result)
+        return result
+
+    def report(self):
+        if self.stats:
+            print(f"YouTube searches: {self.stats['searched']} API calls, {self.stats['exact']} exact cache hits, "
+                  f"{self.stats['similar']} near-duplicate hits, {self.stats['shared']} shared in-flight lookups")
+
+def spool_path(link, suffix):
+    # Per-article files under CACHE_DIR/spool: '.post.partial.<request hash>' holds a blog post while it streams in,
+    # '.row.json' a finished row until it has been written to the sheet
+    spool_dir = os.path.join(CACHE_DIR, "spool")
+    os.makedirs(spool_dir, exist_ok=True)
+    key = hashlib.sha1(canonicalize_url(link).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(spool_dir, key + suffix)
+
+def spool_row(row, sheet_name=SHEET_NAME):
+    # The source link is the last column of every row
+    path = spool_path(row[-1], '.row.json')
+    with open(path + '.tmp', 'w') as spool:
+        json.dump({'sheet': sheet_name, 'row': row}, spool)
+    os.replace(path + '.tmp', path)
+
+def discard_spooled_row(link):
+    path = spool_path(link, '.row.json')
+    if os.path.exists(path):
+        os.remove(path)
+
+def quarantine_spooled_row(link):
+    # Kept under spool/quarantine for inspection, but never retried
+    path = spool_path(link, '.row.json')
+    if os.path.exists(path):
+        quarantine_dir = os.path.join(os.path.dirname(path), "quarantine")
+        os.makedirs(quarantine_dir, exist_ok=True)
+        os.replace(path, os.path.join(quarantine_dir, os.path.basename(path)))
+
+def load_spooled_rows():
+    # Rows finished by an earlier run that never reached the sheet, as {'sheet': ..., 'row': ...}
+    spool_dir = os.path.join(CACHE_DIR, "spool")
+    if not os.path.isdir(spool_dir):
+        return []
+    rows = []
+    for name in sorted(os.listdir(spool_dir)):
+        if name.endswith('.row.json'):
+            with open(os.path.join(spool_dir, name)) as spool:
+                rows.append(json.load(spool))
+    return rows
+
+@lru_cache(maxsize=None)
+def get_youtube_search_cache():
+    return YouTubeSearchCache(get_result_cache())
+
+def build_http_session():
+    # One keep-alive session for the whole run: pooled connections per host, backoff on 429/5xx
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=20, pool_maxsize=max(10, MAX_WORKERS), max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = HTTP_USER_AGENT
+    return session
+
+@lru_cache(maxsize=None)
+def get_http_session():
+    return build_http_session()
+
+def fetch(url, stage='http', **kwargs):
+    response = get_http_session().get(url, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), **kwargs)
+    retries = getattr(response.raw, 'retries', None)
+    if retries and retries.history:
+        run_metrics.record_retry(stage, len(retries.history))
+    return response
+
+def fetch_feed(url):
+    # Conditional GET: when the feed is unchanged since the last run, reuse the body cached then
+    cached = get_result_cache().get('feed', url)
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    response = fetch(url, stage='rss_fetch', headers=headers)
+    if response.status_code == 304 and cached:
+        print("News feed not modified since the last run; using the cached copy.")
+        return cached['content']
+    response.raise_for_status()
+
+    get_result_cache().set('feed', {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'content': response.text
+    }, url)
+    return response.text
+
+def page_encoding(response, head):
+    # The charset from the Content-Type header, else one declared by a <meta> tag in the first chunk. A page
+    # declaring neither is read as UTF-8 when its first chunk decodes as UTF-8, and as windows-1252 otherwise.
+    if 'charset=' in response.headers.get('Content-Type', '').lower():
+        return response.encoding
+    declared = re.search(rb'<meta[^>]+charset=["\']?([\w.:-]+)', head[:4096], re.IGNORECASE)
+    if declared:
+        try:
+            return codecs.lookup(declared.group(1).decode('ascii')).name
+        except LookupError:
+            pass
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head)  # Tolerates a character cut at the chunk boundary
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'windows-1252'
+
+def extract_article_text(response, max_chars=ARTICLE_CHAR_BUDGET, max_bytes=ARTICLE_BYTE_BUDGET):
+    # Feed the streamed page to an incremental lxml parser, keeping paragraph text outside boilerplate
+    # elements, and stop reading as soon as max_chars of text or max_bytes of HTML have been consumed.
+    # Pages without <p> paragraphs fall back to the text of block elements (FALLBACK_BLOCK_TAGS).
+    parser = None
+    paragraphs = []
+    blocks = []
+    collected = 0
+    block_collected = 0
+    received = 0
+    boilerplate_depth = 0
+    paragraph_depth = 0
+    try:
+        for chunk in response.iter_content(chunk_size=16 * 1024):
+            received += len(chunk)
+            if parser is None:
+                parser = etree.HTMLPullParser(events=('start', 'end'), remove_comments=True, remove_pis=True,
+                                              encoding=page_encoding(response, chunk))
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                tag = element.tag.lower() if isinstance(element.tag, str) else ''
+                if tag in BOILERPLATE_TAGS:
+                    if event == 'start':
+                        boilerplate_depth += 1
+                    else:
+                        boilerplate_depth -= 1
+                        element.clear(keep_tail=True)
+                elif tag == 'p':
+                    if event == 'start':
+                        paragraph_depth += 1
+                        continue
+                    paragraph_depth -= 1
+                    if not boilerplate_depth:
+                        text = ' '.join(''.join(element.itertext()).split())
+                        if len(text) >= MIN_PARAGRAPH_CHARS:
+                            paragraphs.append(text)
+                            collected += len(text) + 1
+                    element.clear(keep_tail=True)
+                elif tag in FALLBACK_BLOCK_TAGS and event == 'end' and not paragraphs and not boilerplate_depth and not paragraph_depth:
+                    # Collected blocks are cleared so an enclosing block only adds its remaining text;
+                    # short ones stay and become part of the enclosing block
+                    text = ' '.join(''.join(element.itertext()).split())
+                    if len(text) >= MIN_PARAGRAPH_CHARS:
+                        blocks.append(text)
+                        block_collected += len(text) + 1
+                        element.clear(keep_tail=True)
+            if collected >= max_chars or (not paragraphs and block_collected >= max_chars) or received >= max_bytes:
+                break
+    finally:
+        response.close()
+    return '\n'.join(paragraphs or blocks)[:max_chars]
+
+def fetch_article(link):
+    # Follows the Google News redirect and streams the publisher page in the same request
+    with run_metrics.stage('article_fetch'):
+        response = fetch(link, stage='article_fetch', allow_redirects=True, stream=True)
+        if not response.ok:
+            response.close()
+            response.raise_for_status()
+        article_text = extract_article_text(response)
+    if not article_text:
+        print(f"Warning: no article text could be extracted from {response.url}; the summary will rest on the title alone.")
+    return response.url, article_text
 
 def get_google_sheets_service():
     creds = None
@@ -44,138 +862,607 @@ def get_google_sheets_service():
             creds = flow.run_local_server(port=0)
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
-    return build('sheets', 'v4', credentials=creds)
+    return build_google_service('sheets', 'v4', credentials=creds)
 
-def get_top_google_news():
-    url = "https://news.google.com/rss?hl=en-US&gl=US&ceid=US:en"
+def sheet_range(sheet_name, cells):
+    # A1 notation; tab names are quoted so names with spaces or punctuation parse
+    return "'" + sheet_name.replace("'", "''") + "'!" + cells
 
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-
-        if response.status_code != 200:
-            print(f"Error: Unable to fetch news. Status code: {response.status_code}")
-            return None
-
-        soup = BeautifulSoup(response.content, 'xml')
-        news_items = soup.find_all('item')
-
-        news = []
-        for item in news_items:
-            title = item.title.text
-            link = item.link.text
-            description = item.description.text if item.description else ""
-            if not is_political_news(title, description):
-                news.append({"title": title, "link": link})
-            if len(news) == 10:  # TODO: Change this back to 20 later
+class BufferedSheetWriter:
+    # Collects rows and writes them in batched requests starting at the sheet's next free row
+    def __init__(self, sheets_service, spreadsheet_id, sheet_name=SHEET_NAME, flush_every=SHEET_FLUSH_EVERY, chunk_rows=SHEET_CHUNK_ROWS, on_written=None):
+        self.sheets_service = sheets_service
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.flush_every = flush_every
+        self.chunk_rows = max(1, chunk_rows)
+        self.on_written = on_written
+        self.rows = []
+        self.next_row = None
+
+    def execute(self, request):
+        # Retry quota and transient errors with exponential backoff and jitter
+        for attempt in range(SHEET_WRITE_RETRIES + 1):
+            try:
+                return request.execute()
+            except HttpError as e:
+                retryable = e.resp.status in (429, 500, 502, 503) or (
+                    e.resp.status == 403 and ('rateLimitExceeded' in str(e) or 'quota' in str(e).lower())
+                )
+                if not retryable or attempt == SHEET_WRITE_RETRIES:
+                    raise
+                delay = 2 ** attempt + random.uniform(0, 1)
+                run_metrics.record_retry('sheets_write')
+                print(f"Sheets API error {e.resp.status}; retrying in {delay:.1f}s...")
+                time.sleep(delay)
+
+    def find_next_row(self):
+        with run_metrics.stage('sheets_read'):
+            result = self.execute(self.sheets_service.spreadsheets().values().get(
+                spreadsheetId=self.spreadsheet_id,
+                range=sheet_range(self.sheet_name, 'A:A')
+            ))
+        return len(result.get('values', [])) + 1
+
+    def add(self, row):
+        self.rows.append(row)
+        if self.flush_every and len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.next_row is None:
+            self.next_row = self.find_next_row()
+
+        while self.rows:
+            chunk = self.rows[:self.chunk_rows]
+            last_column = chr(ord('A') + max(len(row) for row in chunk) - 1)
+            end_row = self.next_row + len(chunk) - 1
+            range_name = sheet_range(self.sheet_name, f'A{self.next_row}:{last_column}{end_row}')
+            with run_metrics.stage('sheets_write'):
+                self.execute(self.sheets_service.spreadsheets().values().update(
+                    spreadsheetId=self.spreadsheet_id,
+                    range=range_name,
+                    valueInputOption="RAW",
+                    body={'values': chunk}
+                ))
+            print(f"Data written to {range_name}")
+            self.next_row = end_row + 1
+            del self.rows[:len(chunk)]
+            if self.on_written:
+                self.on_written(chunk)
+
+def strip_outlet(title, source=""):
+    # Google News titles end with " - Outlet". The suffix is only dropped when it names the item's source:
+    # other feeds have titles like "Live updates - Hurricane Milton" where the part after the dash is the story.
+    suffix = f" - {source}"
+    return title[:-len(suffix)] if source and title.endswith(suffix) else title
+
+def title_fingerprint(title, source=""):
+    # Compare on the normalized words of the title without its outlet
+    words = re.findall(r'\w+', strip_outlet(title, source).lower())
+    return hashlib.sha1(' '.join(words).encode('utf-8')).hexdigest()
+
+class PublishedIndex:
+    # Local index of article links and title fingerprints already written to the sheet
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS published (key TEXT PRIMARY KEY, published_at REAL NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS seeded_sheets (sheet TEXT PRIMARY KEY, seeded_at REAL NOT NULL)")
+        self._conn.commit()
+
+    def contains(self, article):
+        keys = ('url:' + canonicalize_url(article['link']), 'title:' + title_fingerprint(article['title'], article.get('source', "")))
+        return self._conn.execute(
+            "SELECT 1 FROM published WHERE key IN (?, ?) LIMIT 1", keys
+        ).fetchone() is not None
+
+    def add(self, link, title=None, source=""):
+        now = time.time()
+        keys = ['url:' + canonicalize_url(link)]
+        if title:
+            keys.append('title:' + title_fingerprint(title, source))
+        self._conn.executemany("INSERT OR REPLACE INTO published (key, published_at) VALUES (?, ?)", [(key, now) for key in keys])
+        self._conn.commit()
+
+    def seed_from_sheet(self, sheets_service, spreadsheet_id, sheet_name=SHEET_NAME):
+        # Done once per sheet: later runs rely on the local index alone
+        sheet = f'{spreadsheet_id}/{sheet_name}'
+        if self._conn.execute("SELECT 1 FROM seeded_sheets WHERE sheet = ?", (sheet,)).fetchone():
+            return
+        result = sheets_service.spreadsheets().values().get(
+            spreadsheetId=spreadsheet_id,
+            range=sheet_range(sheet_name, 'F:F')
+        ).execute()
+        links = [row[0] for row in result.get('values', []) if row and row[0].startswith('http')]
+        for link in links:
+            self.add(link)
+        self._conn.execute("INSERT INTO seeded_sheets (sheet, seeded_at) VALUES (?, ?)", (sheet, time.time()))
+        self._conn.commit()
+        print(f"Seeded the published-article index with {len(links)} links from {sheet_name}.")
+
+class RunState:
+    # Durable per-article progress through ARTICLE_STAGES, one record per article and run, so an interrupted
+    # run can be resumed without repeating finished work. Safe to share between threads.
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.run_id = None
+        self.resumed = False
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "run_id TEXT PRIMARY KEY, started_at REAL NOT NULL, finished_at REAL, resumes INTEGER NOT NULL DEFAULT 0)"
+        )
+        if 'resumes' not in {column[1] for column in self._conn.execute("PRAGMA table_info(runs)")}:
+            self._conn.execute("ALTER TABLE runs ADD COLUMN resumes INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS articles ("
+            "run_id TEXT NOT NULL, key TEXT NOT NULL, position INTEGER NOT NULL, stage TEXT NOT NULL, "
+            "data TEXT NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (run_id, key))"
+        )
+        self._conn.commit()
+
+    def start(self, resume=False):
+        now = time.time()
+        with self._lock:
+            row = None
+            if resume:
+                row = self._conn.execute(
+                    "SELECT run_id, resumes FROM runs WHERE finished_at IS NULL AND started_at >= ? ORDER BY started_at DESC LIMIT 1",
+                    (now - RESUME_MAX_AGE_SECONDS,)
+                ).fetchone()
+                if row and row[1] >= RESUME_MAX_ATTEMPTS:
+                    print(f"Run {row[0]} was already resumed {row[1]} times; starting a new run.")
+                    row = None
+            if row:
+                self.run_id, self.resumed = row[0], True
+                self._conn.execute("UPDATE runs SET resumes = resumes + 1 WHERE run_id = ?", (self.run_id,))
+            else:
+                self.run_id, self.resumed = datetime.now().strftime('%Y%m%d-%H%M%S-%f'), False
+                # Unfinished runs that are not resumed now never will be
+                self._conn.execute("UPDATE runs SET finished_at = ? WHERE finished_at IS NULL", (now,))
+                self._conn.execute("INSERT INTO runs (run_id, started_at) VALUES (?, ?)", (self.run_id, now))
+                # Old runs are only kept as long as cached results
+                expired = (now - CACHE_TTL_SECONDS, now - CACHE_TTL_SECONDS)
+                self._conn.execute(
+                    "DELETE FROM articles WHERE run_id IN (SELECT run_id FROM runs WHERE finished_at < ? OR started_at < ?)", expired
+                )
+                self._conn.execute("DELETE FROM runs WHERE finished_at < ? OR started_at < ?", expired)
+            self._conn.commit()
+        if self.resumed:
+            print(f"Resuming run {self.run_id}.")
+        return self.run_id
+
+    def add_fetched(self, articles):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO articles (run_id, key, position, stage, data, updated_at) VALUES (?, ?, ?, 'fetched', ?, ?)",
+                [(self.run_id, canonicalize_url(article['link']), position, json.dumps(article), now)
+                 for position, article in enumerate(articles)]
+            )
+            self._conn.commit()
+
+    def articles(self):
+        # Every article of the run in feed order, each with its stage and recorded data
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stage, data FROM articles WHERE run_id = ? ORDER BY position", (self.run_id,)
+            ).fetchall()
+        return [{**json.loads(data), 'stage': stage} for stage, data in rows]
+
+    def get(self, link):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT stage, data FROM articles WHERE run_id = ? AND key = ?", (self.run_id, canonicalize_url(link))
+            ).fetchone()
+        return {**json.loads(row[1]), 'stage': row[0]} if row else None
+
+    def advance(self, link, stage, **data):
+        # Records that the article finished stage, merging data into what is stored for it
+        key = canonicalize_url(link)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM articles WHERE run_id = ? AND key = ?", (self.run_id, key)
+            ).fetchone()
+            if row is None:
+                return
+            self._conn.execute(
+                "UPDATE articles SET stage = ?, data = ?, updated_at = ? WHERE run_id = ? AND key = ?",
+                (stage, json.dumps({**json.loads(row[0]), **data}), time.time(), self.run_id, key)
+            )
+            self._conn.commit()
+
+    def finish(self):
+        with self._lock:
+            self._conn.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), self.run_id))
+            self._conn.commit()
+
+def make_article(title, link, description="", source="", published="", feed=""):
+    # The one article record every feed source produces
+    return {
+        "title": title,
+        "link": link,
+        "description": description,
+        "source": source,
+        "published": published,
+        "feed": feed
+    }
+
+class RSSFeedSource:
+    # Any RSS 2.0 feed
+    def __init__(self, url, name=None):
+        self.url = url
+        self.name = name or url
+
+    def fetch_articles(self):
+        with run_metrics.stage('rss_fetch'):
+            soup = BeautifulSoup(fetch_feed(self.url), 'xml')
+        return [
+            make_article(
+                item.title.text,
+                item.link.text,
+                item.description.text if item.description else "",
+                item.source.text if item.source else "",
+                item.pubDate.text if item.pubDate else "",
+                self.name
+            )
+            for item in soup.find_all('item')
+            if item.title and item.title.text.strip() and item.link and item.link.text.strip()  # Malformed items are skipped
+        ]
+
+class GoogleNewsSource(RSSFeedSource):
+    # Google News top stories or one topic section (WORLD, NATION, BUSINESS, TECHNOLOGY, ENTERTAINMENT,
+    # SPORTS, SCIENCE, HEALTH) for one language and region
+    def __init__(self, language='en', region='US', topic=None):
+        path = f"/headlines/section/topic/{topic.upper()}" if topic else ""
+        query = urlencode({'hl': f"{language}-{region}", 'gl': region, 'ceid': f"{region}:{language}"}, safe=':')
+        super().__init__(f"{GOOGLE_NEWS_BASE_URL}{path}?{query}", name=f"google:{language}-{region}:{topic or 'top'}")
+
+class NewsAPISource:
+    # NewsAPI top headlines for one country and optional category, up to `pages` pages
+    def __init__(self, country='us', category=None, pages=NEWS_API_PAGES, page_size=NEWS_API_PAGE_SIZE):
+        self.country = country
+        self.category = category
+        self.pages = pages
+        self.page_size = page_size
+        self.name = f"newsapi:{country}:{category or 'top'}"
+
+    def fetch_articles(self):
+        articles = []
+        for page in range(1, self.pages + 1):
+            params = {'country': self.country, 'pageSize': self.page_size, 'page': page, 'apiKey': os.getenv("NEWS_API")}
+            if self.category:
+                params['category'] = self.category
+            with run_metrics.stage('newsapi_fetch'):
+                response = fetch(NEWS_API_URL, stage='newsapi_fetch', params=params)
+                response.raise_for_status()
+                data = response.json()
+            results = data.get('articles', [])
+            articles.extend(
+                make_article(
+                    result['title'],
+                    result['url'],
+                    result.get('description') or "",
+                    (result.get('source') or {}).get('name') or "",
+                    result.get('publishedAt') or "",
+                    self.name
+                )
+                for result in results
+                if result.get('url') and result.get('title') and result['title'] != '[Removed]'
+            )
+            if len(results) < self.page_size or page * self.page_size >= data.get('totalResults', 0):
                 break
+        return articles
 
-        return news
-    except requests.RequestException as e:
-        print(f"Error: Unable to fetch news. {str(e)}")
-        return None
+def parse_feed_source(spec):
+    kind, _, rest = spec.partition(':')
+    if kind == 'rss' and rest:
+        return RSSFeedSource(rest)
+    args = rest.split(':') if rest else []
+    if kind == 'google' and len(args) <= 2:
+        language, _, region = (args[0] if args else 'en-US').partition('-')
+        return GoogleNewsSource(language, region or language.upper(), args[1] if len(args) > 1 else None)
+    if kind == 'newsapi' and len(args) <= 2:
+        return NewsAPISource(args[0] if args else 'us', args[1] if len(args) > 1 else None)
+    raise ValueError(f"Unknown news feed source '{spec}'")
+
+def parse_news_feeds(spec):
+    # Sheet tab -> feed sources, in the order the tabs are filled
+    if not spec.strip():
+        return {SHEET_NAME: [RSSFeedSource(GOOGLE_NEWS_RSS_URL, name='google:en-US:top')]}
+    feeds = {}
+    for entry in spec.split(';'):
+        if not entry.strip():
+            continue
+        tab, _, sources = entry.partition('=')
+        feeds[tab.strip()] = [parse_feed_source(source.strip()) for source in sources.split(',') if source.strip()]
+        if not feeds[tab.strip()]:
+            raise ValueError(f"NEWS_FEEDS entry '{entry}' has no feed sources")
+    return feeds
+
+def fetch_sources(sources):
+    # All sources at once; a source that fails contributes nothing instead of failing the run
+    def fetch_source(source):
+        try:
+            return source.fetch_articles()
+        except Exception as e:
+            print(f"Error: Unable to fetch news from {source.name}. {str(e)}")
+            return []
+
+    # Create the shared cache and session before the threads start: lru_cache does not stop concurrent
+    # first calls from each building their own
+    get_result_cache()
+    get_http_session()
+    with ThreadPoolExecutor(max_workers=max(1, len(sources))) as feed_executor:
+        return list(feed_executor.map(fetch_source, sources))
+
+def merge_feeds(feeds, k=FEED_RANK_K):
+    # Reciprocal rank fusion: each article scores the sum of 1 / (k + rank) over the feeds listing it, so stories
+    # several feeds agree on come first. Duplicates (by canonical URL) keep the record of the first feed listing them.
+    articles = {}
+    scores = Counter()
+    for feed in feeds:
+        for rank, article in enumerate(feed, 1):
+            key = canonicalize_url(article['link'])
+            if key in articles and articles[key]['feed'] == article['feed']:
+                continue  # Listed twice by the same feed
+            articles.setdefault(key, article)
+            scores[key] += 1.0 / (k + rank)
+    return [articles[key] for key in sorted(articles, key=scores.__getitem__, reverse=True)]
+
+def story_text(item):
+    # The outlet is dropped from the title, and from the description, which is HTML repeating title and outlet
+    title = strip_outlet(item['title'], item.get('source', ""))
+    description = BeautifulSoup(item.get('description') or '', 'html.parser')
+    for outlet in description.find_all('font'):
+        outlet.decompose()
+    return f"{title} {description.get_text(' ')}"
+
+def cluster_stories(items, threshold=STORY_SIMILARITY_THRESHOLD):
+    # Groups items whose TF-IDF vectors have a cosine similarity of at least threshold, transitively.
+    # Returns lists of item indices in feed order, so each cluster starts with its highest-ranked item.
+    token_sets = [search_phrase_tokens(story_text(item)) for item in items]
+    vocabulary = {token: n for n, token in enumerate(sorted(set().union(*token_sets)))}
+    if len(items) < 2 or not vocabulary:
+        return [[n] for n in range(len(items))]
+
+    tf = np.zeros((len(items), len(vocabulary)))
+    for row, tokens in enumerate(token_sets):
+        tf[row, [vocabulary[token] for token in tokens]] = 1.0
+    # Smoothed idf: words in every item still count, so two copies of one story match even when they are
+    # the only items; common words are kept out by SEARCH_STOPWORDS
+    idf = np.log((1 + len(items)) / (1 + tf.sum(axis=0))) + 1
+    vectors = tf * idf
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+    similar = np.triu(vectors @ vectors.T >= threshold, k=1)
+
+    parent = list(range(len(items)))
+
+    def find(n):
+        while parent[n] != n:
+            parent[n] = parent[parent[n]]
+            n = parent[n]
+        return n
+
+    for a, b in zip(*np.nonzero(similar)):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    clusters = {}
+    for n in range(len(items)):
+        clusters.setdefault(find(n), []).append(n)
+    return list(clusters.values())
+
+def dedupe_stories(items):
+    # One item per story; the others are kept on it as 'related' so they can be marked published with it
+    clusters = cluster_stories(items)
+    stories = [
+        {**items[cluster[0]], 'related': [{'title': items[n]['title'], 'link': items[n]['link'], 'source': items[n].get('source', "")} for n in cluster[1:]]}
+        for cluster in clusters
+    ]
+    if len(stories) < len(items):
+        print(f"Merged {len(items) - len(stories)} news items covering the same stories as higher-ranked ones.")
+    return stories
+
+def reached(record, stage):
+    return record is not None and ARTICLE_STAGES.index(record['stage']) >= ARTICLE_STAGES.index(stage)
+
+def get_top_google_news(published_index=None, run_state=None, sources=None, tab=SHEET_NAME, exclude=frozenset()):
+    # Up to NEWS_COUNT non-political articles for one sheet tab, merged from its feed sources; articles whose
+    # canonical URL is in exclude (taken by an earlier tab) are left out
+    # The feeds as an interrupted run saw them, with the verdicts it already has; fetched afresh when
+    # that run stopped before recording them
+    news_items = [item for item in run_state.articles() if item.get('tab', SHEET_NAME) == tab] if run_state and run_state.resumed else []
+    if not news_items:
+        news_items = merge_feeds(fetch_sources(sources or parse_news_feeds("")[SHEET_NAME]))
+        news_items = [item for item in news_items if canonicalize_url(item['link']) not in exclude]
+        if published_index:
+            fresh_items = [item for item in news_items if not published_index.contains(item)]
+            print(f"Skipping {len(news_items) - len(fresh_items)} news items already in the sheet.")
+            news_items = fresh_items
+        if STORY_DEDUP:
+            news_items = dedupe_stories(news_items)
+        news_items = [{**item, 'tab': tab} for item in news_items]
+        if run_state:
+            run_state.add_fetched(news_items)
+
+    result_cache = get_result_cache()
+    news = []
+    for start in range(0, len(news_items), CLASSIFY_BATCH_SIZE):
+        batch = news_items[start:start + CLASSIFY_BATCH_SIZE]
+        verdicts = [
+            item['political'] if 'political' in item else
+            result_cache.get('classification', canonicalize_url(item['link']), MODEL, CLASSIFY_PROMPT_VERSION)
+            for item in batch
+        ]
+        uncached = [n for n, political in enumerate(verdicts) if political is None]
+        if uncached:
+            fresh = classify_political_news_batch([batch[n] for n in uncached])
+            for n, political in zip(uncached, fresh):
+                verdicts[n] = political
+                if political is not None:
+                    result_cache.set('classification', political, canonicalize_url(batch[n]['link']), MODEL, CLASSIFY_PROMPT_VERSION)
+        if run_state:
+            for item, political in zip(batch, verdicts):
+                if political is not None and 'political' not in item:
+                    run_state.advance(item['link'], 'classified', political=political)
+
+        for item, political in zip(batch, verdicts):
+            if not political:  # Items that could not be classified default to non-political
+                news.append({"title": item['title'], "link": item['link'], "source": item.get('source', ""), "related": item.get('related', []), "tab": tab})
+            if len(news) == NEWS_COUNT:
+                return news
+
+    return news
+
+def classify_political_news(title, text):
+    response = create_message(
+        'classification',
+        model=MODEL,
+        max_tokens=50,
+        temperature=0,
+        system="You are an AI assistant that determines if a news article is political or not. Respond with only 'True' for political news or 'False' for non-political news.",
+        messages=[
+            {"role": "user", "content": f"Is this news article political? Title: '{title}'\n\nText: {text}"}
+        ]
+    )
+    return response.content[0].text.strip().lower() == 'true'
 
 def is_political_news(title, text):
     try:
-        response = anthropic_client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=50,
-            temperature=0,
-            system="You are an AI assistant that determines if a news article is political or not. Respond with only 'True' for political news or 'False' for non-political news.",
-            messages=[
-                {"role": "user", "content": f"Is this news article political? Title: '{title}'\n\nText: {text}"}
-            ]
-        )
-        return response.content[0].text.strip().lower() == 'true'
+        return classify_political_news(title, text)
     except Exception:
         return False  # Default to non-political if classification fails
 
-def get_original_url(google_news_url):
+def classify_political_news_batch(items):
+    # Classify many RSS items in one request; items missing from the reply are classified one by one.
+    # Returns True/False per item, or None where classification failed.
+    listing = "\n\n".join(
+        f"{n}. Title: '{item['title']}'\nText: {item['description']}" for n, item in enumerate(items, 1)
+    )
+    verdicts = {}
     try:
-        response = requests.get(google_news_url, allow_redirects=True)
-        return response.url
+        response = create_message(
+            'classification',
+            model=MODEL,
+            max_tokens=20 + 10 * len(items),
+            temperature=0,
+            system="You are an AI assistant that determines if news articles are political or not. Respond with only a JSON object mapping each article number to true for political news or false for non-political news, for example {\"1\": true, \"2\": false}.",
+            messages=[
+                {"role": "user", "content": f"Are these news articles political?\n\n{listing}"}
+            ]
+        )
+        text = response.content[0].text
+        parsed = json.loads(text[text.index('{'):text.rindex('}') + 1])
+        verdicts = {int(n): value for n, value in parsed.items() if str(n).isdigit() and isinstance(value, bool)}
     except Exception as e:
-        print(f"Error getting original URL: {e}")
-        return None
+        print(f"Error classifying news batch: {e}")
+
+    missing = [n for n in range(1, len(items) + 1) if n not in verdicts]
+    if missing:
+        print(f"Classifying {len(missing)} of {len(items)} news items individually.")
+    for n in missing:
+        item = items[n - 1]
+        try:
+            verdicts[n] = classify_political_news(item['title'], item['description'])
+        except Exception as e:
+            print(f"Error classifying news item '{item['title']}': {e}")
+            verdicts[n] = None
+    return [verdicts[n] for n in range(1, len(items) + 1)]
+
+def validate_article_content(content):
+    # Check the tool input against ARTICLE_CONTENT_TOOL's schema: every required field is a non-empty string
+    schema = ARTICLE_CONTENT_TOOL['input_schema']
+    for field in schema['required']:
+        value = content.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"Article content field '{field}' is missing or empty")
+    return {field: content[field].strip() for field in schema['properties']}
 
 def summarize_article(title, link):
-    try:
-        original_url = get_original_url(link)
-        if not original_url:
-            return "Unable to get original URL.", "#News", "", "", ""
+    # Summary, hashtag, educational content, entity summaries, YouTube search phrase and the rewritten title
+    # come back together from one tool-use call
+    cache_key = (canonicalize_url(link), MODEL, SUMMARY_PROMPT_VERSION)
+    cached = get_result_cache().get('summary', *cache_key)
+    if cached is not None:
+        return cached
 
-        response = requests.get(original_url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        article_text = soup.get_text()
+    try:
+        original_url, article_text = fetch_article(link)
 
-        summary_prompt = f"Summarize the following news article in five parts: 1) A brief 5-minute read summary. 2) A relevant hashtag for the article. 3) Educational content related to key terms or concepts in the summary (2-3 paragraphs max). 4) Short summaries of any places, person names, company names, brand names, business names, sports club names, food names, device names, tool names, country names, region names, or geographical feature names mentioned in the summary. 5) A short phrase or a few keywords (1-5 words) that capture the main topic or focus of the article, suitable for a YouTube search. Separate the five parts with '|||'. Title: {title}\n\nArticle content: {article_text[:2000]}..."
+        summary_prompt = f"Summarize the following news article and record the summary, a hashtag, educational content, entity summaries, a YouTube search phrase and a rewritten title. Title: {title}\n\nArticle content: {article_text}..."
 
-        summary_response = anthropic_client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=1000,
+        summary_response = create_message(
+            'summarize',
+            model=MODEL,
+            max_tokens=1500,
             temperature=0.7,
-            system="You are an AI assistant that summarizes news articles concisely, provides educational context, gives short summaries of important names or entities mentioned, and creates a short phrase or keywords for YouTube search. Always provide five parts in your response, separated by '|||'. Do not include any labels or numbering for the parts.",
+            system="You are an AI assistant that summarizes news articles concisely, provides educational context, gives short summaries of important names or entities mentioned, creates a short phrase or keywords for YouTube search, and rewrites news titles to be catchy and engaging without citing any source. Always record your answer with the record_article_content tool.",
+            tools=[ARTICLE_CONTENT_TOOL],
+            tool_choice={"type": "tool", "name": ARTICLE_CONTENT_TOOL['name']},
             messages=[
                 {"role": "user", "content": summary_prompt}
             ]
         )
-        parts = summary_response.content[0].text.strip().split('|||')
-        if len(parts) != 5:
-            print(f"Warning: Expected 5 parts in the summary, but got {len(parts)}. Adjusting...")
-            while len(parts) < 5:
-                parts.append("N/A")
-            parts = parts[:5]
-        full_summary, hashtag, educational_content, entity_summaries, youtube_search_phrase = parts
-
-        # Check if youtube_search_phrase is N/A and try to generate one if it is
-        if youtube_search_phrase.strip() == "N/A":
-            print("YouTube search phrase is N/A. Attempting to generate one...")
-            youtube_search_prompt = f"Create a short phrase or a few keywords (1-5 words) that capture the main topic or focus of this article, suitable for a YouTube search. Title: {title}\n\nSummary: {full_summary}"
-            youtube_search_response = anthropic_client.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=20,
-                temperature=0.7,
-                system="You are an AI assistant that creates short, relevant phrases or keywords for YouTube searches based on news articles. Provide only the search phrase or keywords without any additional text.",
-                messages=[
-                    {"role": "user", "content": youtube_search_prompt}
-                ]
-            )
-            youtube_search_phrase = youtube_search_response.content[0].text.strip()
+        tool_input = next(block.input for block in summary_response.content if block.type == 'tool_use')
+        content = validate_article_content(tool_input)
+        if not content['hashtag'].startswith('#'):
+            content['hashtag'] = '#' + content['hashtag']
 
-        return full_summary.strip(), hashtag.strip(), educational_content.strip(), entity_summaries.strip(), youtube_search_phrase.strip()
+        get_result_cache().set('summary', content, *cache_key)
+        return content
     except Exception as e:
         print(f"Error summarizing article: {e}")
-        return "Unable to generate summary.", "#News", "", "", ""
+        return {
+            "summary": SUMMARY_FALLBACK,
+            "hashtag": "#News",
+            "educational_content": "",
+            "entity_summaries": "",
+            "youtube_search_phrase": "",
+            "title": title  # Keep the original title if rewriting fails
+        }
+
+def youtube_search(youtube_search_phrase):
+    def search():
+        with run_metrics.stage('youtube_search'):
+            return get_youtube_service().search().list(
+                q=youtube_search_phrase,
+                type='video',
+                part='id,snippet',
+                maxResults=1
+            ).execute()
+
+    search_response = request_scheduler.call('youtube', search, STAGE_PRIORITIES['youtube_search'], stage='youtube_search')
+    if not search_response['items']:
+        return None, None, None
+    video = search_response['items'][0]
+    video_id = video['id']['videoId']
+    video_title = video['snippet']['title']
+    video_description = video['snippet']['description']
+    video_link = f"https://www.youtube.com/watch?v={video_id}"
+    return video_link, video_title, video_description
 
 def search_youtube_video(youtube_search_phrase):
-    if youtube_search_phrase == "N/A":
-        print("YouTube search phrase is N/A. Skipping YouTube search.")
+    if not youtube_search_phrase or youtube_search_phrase == "N/A":
+        print("No YouTube search phrase. Skipping YouTube search.")
         return None, None, None
 
     try:
-        search_response = youtube.search().list(
-            q=youtube_search_phrase,
-            type='video',
-            part='id,snippet',
-            maxResults=1
-        ).execute()
-
-        if search_response['items']:
-            video = search_response['items'][0]
-            video_id = video['id']['videoId']
-            video_title = video['snippet']['title']
-            video_description = video['snippet']['description']
-            video_link = f"https://www.youtube.com/watch?v={video_id}"
-            return video_link, video_title, video_description
-        else:
+        video_link, video_title, video_description = get_youtube_search_cache().lookup(youtube_search_phrase, youtube_search)
+        if not video_link:
             print("No relevant YouTube videos found.")
-            return None, None, None
+        return video_link, video_title, video_description
     except Exception as e:
         print(f"Error searching YouTube: {e}")
         return None, None, None
 
-def create_blog_post(title, full_summary, hashtag, educational_content, entity_summaries, youtube_search_phrase, video_link):
+def create_blog_post(title, full_summary, hashtag, educational_content, entity_summaries, youtube_search_phrase, video_link, spool_file=None):
     blog_post_prompt = f"""
     Create a compelling, engaging, educational, informational, fun, and catchy blog post using the following components:
 
@@ -217,90 +1504,210 @@ def create_blog_post(title, full_summary, hashtag, educational_content, entity_s
     Provide the blog post without any additional text.
     """
 
+    request = dict(
+        model=MODEL,
+        max_tokens=1500,
+        temperature=0.7,
+        system="You are an AI assistant that creates engaging and informative blog posts based on news articles and related information. Provide the blog post without any additional text.",
+        messages=[
+            {"role": "user", "content": blog_post_prompt}
+        ]
+    )
+
     try:
-        response = anthropic_client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=1500,
-            temperature=0.7,
-            system="You are an AI assistant that creates engaging and informative blog posts based on news articles and related information. Provide the blog post without any additional text.",
-            messages=[
-                {"role": "user", "content": blog_post_prompt}
-            ]
-        )
+        if STREAMING_MODE and spool_file:
+            return stream_message('blog_post', spool_file, **request).strip()
+        response = create_message('blog_post', **request)
         return response.content[0].text.strip()
     except Exception as e:
         print(f"Error creating blog post: {e}")
-        return "Unable to generate blog post."
+        return BLOG_POST_FALLBACK
 
-def rewrite_title(title):
-    try:
-        new_title_prompt = f"Rewrite the following news title without citing any source, making it catchy and engaging. Provide only the rewritten title without any additional text: '{title}'"
-        new_title_response = anthropic_client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=50,
-            temperature=0.7,
-            system="You are an AI assistant that rewrites news titles to be catchy and engaging without citing any source. Provide only the rewritten title without any additional text.",
-            messages=[
-                {"role": "user", "content": new_title_prompt}
-            ]
-        )
-        return new_title_response.content[0].text.strip()
-    except Exception as e:
-        print(f"Error rewriting title: {e}")
-        return title  # Return original title if rewriting fails
+def process_article(article, run_state=None):
+    with run_metrics.article(article['title']):
+        row = build_article_row(article, run_state)
+    # Keep the finished row on disk until it is in the sheet, so a crash or timeout does not lose it
+    spool_row(row, article.get('tab', SHEET_NAME))
+    for partial_post in glob.glob(glob.escape(spool_path(article['link'], '.post.partial')) + '.*'):
+        os.remove(partial_post)
+    return row
 
-def get_top_news():
-    news = get_top_google_news()
+def build_article_row(article, run_state=None):
+    link = article['link']
+    # Results an interrupted run already recorded for this article are reused. Fallback summaries and
+    # posts are not recorded, and neither is a post written from a fallback summary, so both are retried.
+    record = (run_state.get(link) if run_state else None) or {}
 
-    if not news:
-        print("No news articles found from Google News.")
-        return
+    # Summarize the article and rewrite its title for the blog post
+    if 'content' in record and 'blog_title' in record:
+        content = {**record['content'], 'title': record['blog_title']}
+        summarized = True
+    else:
+        content = summarize_article(article['title'], link)
+        summarized = content['summary'] != SUMMARY_FALLBACK
+        if run_state and summarized:
+            # Both come from the same tool-use call, but are recorded as separate stages
+            run_state.advance(link, 'summarized', content={key: value for key, value in content.items() if key != 'title'})
+            run_state.advance(link, 'titled', blog_title=content['title'])
+    youtube_search_phrase = content['youtube_search_phrase']
 
+    # Search for a related YouTube video based on the YouTube search phrase; "no video" is recorded too
+    if 'video' in record and summarized:
+        video_link, video_title, video_description = record['video']
+    else:
+        video_link, video_title, video_description = search_youtube_video(youtube_search_phrase)
+        if run_state and summarized:
+            run_state.advance(link, 'video', video=[video_link, video_title, video_description])
+
+    # Create the blog post
+    if 'blog_post' in record:
+        blog_post = record['blog_post']
+    else:
+        blog_post = create_blog_post(content['title'], content['summary'], content['hashtag'], content['educational_content'], content['entity_summaries'], youtube_search_phrase, video_link,
+                                     spool_file=spool_path(link, '.post.partial'))
+        if run_state and summarized and blog_post != BLOG_POST_FALLBACK:
+            run_state.advance(link, 'post', blog_post=blog_post)
+
+    # Prepare the data for Google Sheets
+    return [
+        content['title'],
+        blog_post,
+        content['hashtag'],
+        youtube_search_phrase if youtube_search_phrase else "",
+        video_link if video_link else "No video found",
+        link
+    ]
+
+def get_top_news(resume=RESUME_MODE):
+    global run_metrics
+    run_metrics = RunMetrics()
+
+    # Failed and empty runs get a report and cache maintenance too
+    try:
+        write_top_news(resume)
+    finally:
+        result_cache = get_result_cache()
+        result_cache.evict()
+        result_cache.report()
+        get_youtube_search_cache().report()
+        run_metrics.emit()
+
+def write_top_news(resume=RESUME_MODE):
+    run_state = RunState(os.path.join(CACHE_DIR, "runs.sqlite3"))
+    run_state.start(resume)
+
+    feeds = parse_news_feeds(NEWS_FEEDS)
     sheets_service = get_google_sheets_service()
 
-    for i, article in enumerate(news, 1):
-        original_title = article['title']
-        link = article['link']
+    published_index = None
+    if INCREMENTAL_MODE:
+        published_index = PublishedIndex(os.path.join(CACHE_DIR, "published.sqlite3"))
+        for tab in feeds:
+            published_index.seed_from_sheet(sheets_service, SPREADSHEET_ID, tab)
 
-        # Summarize the article with the original title
-        full_summary, hashtag, educational_content, entity_summaries, youtube_search_phrase = summarize_article(original_title, link)
+    published_as = {}
+    related = {}
 
-        # Rewrite the title for the blog post
-        new_title = rewrite_title(original_title)
+    def rows_written(rows):
+        # The source link is the last column of every row; other outlets' coverage of the story counts as published too
+        for row in rows:
+            discard_spooled_row(row[-1])
+            run_state.advance(row[-1], 'written')
+            if published_index:
+                published_index.add(row[-1], *published_as.get(row[-1], (None, "")))
+                for item in related.get(row[-1], []):
+                    published_index.add(item['link'], item['title'], item.get('source', ""))
 
-        # Search for a related YouTube video based on the YouTube search phrase
-        video_link, video_title, video_description = search_youtube_video(youtube_search_phrase)
+    sheet_writers = {}
 
-        # Create the blog post
-        blog_post = create_blog_post(new_title, full_summary, hashtag, educational_content, entity_summaries, youtube_search_phrase, video_link)
+    def sheet_writer_for(tab):
+        # One writer per tab, each tracking its own next free row
+        if tab not in sheet_writers:
+            sheet_writers[tab] = BufferedSheetWriter(sheets_service, SPREADSHEET_ID, tab, flush_every=1 if STREAMING_MODE else SHEET_FLUSH_EVERY, on_written=rows_written)
+        return sheet_writers[tab]
 
-        # Prepare the data for Google Sheets
-        row_data = [
-            new_title,
-            blog_post,
-            hashtag,
-            youtube_search_phrase if youtube_search_phrase else "",
-            video_link if video_link else "No video found"
-        ]
+    # Rows an earlier run finished but never wrote go out first
+    spooled_rows = load_spooled_rows()
+    if spooled_rows:
+        print(f"Writing {len(spooled_rows)} rows left over from an earlier run.")
+    for tab in dict.fromkeys(spooled['sheet'] for spooled in spooled_rows):
+        sheet_writer = sheet_writer_for(tab)
+        try:
+            for spooled in spooled_rows:
+                if spooled['sheet'] == tab:
+                    sheet_writer.add(spooled['row'])
+            sheet_writer.flush()
+        except HttpError as e:
+            # A failed tab must not stop this run. Rows the sheet rejects outright (a renamed or deleted tab,
+            # a malformed row) are quarantined so they cannot fail every later run; the rest stay spooled.
+            sheet_writer.rows.clear()
+            unwritten = [spooled['row'][-1] for spooled in spooled_rows
+                         if spooled['sheet'] == tab and os.path.exists(spool_path(spooled['row'][-1], '.row.json'))]
+            if 400 <= e.resp.status < 500 and e.resp.status != 429:
+                for link in unwritten:
+                    quarantine_spooled_row(link)
+                print(f"Sheets rejected {len(unwritten)} leftover rows for {tab} ({e.resp.status}); moved them to the spool quarantine.")
+            else:
+                print(f"Could not write {len(unwritten)} leftover rows to {tab} ({e.resp.status}); they stay spooled for the next run.")
+    # An article goes to one tab only, the first whose feeds list it
+    claimed = {canonicalize_url(spooled['row'][-1]) for spooled in spooled_rows}
 
-        # Append the data to the Google Sheet
-        range_name = f'Sheet1!A{i}:E{i}'
-        body = {
-            'values': [row_data]
-        }
-        sheets_service.spreadsheets().values().append(
-            spreadsheetId=SPREADSHEET_ID,
-            range=range_name,
-            valueInputOption="RAW",
-            body=body
-        ).execute()
-        # print(f"Data appended to {current_date}!A{i}:D{i}")
-        print(f"Data appended to Sheet1!A{i}:E{i}")
+    def select_news():
+        taken = set(claimed)
+        selected = []
+        for tab, sources in feeds.items():
+            tab_news = get_top_google_news(published_index, run_state, sources, tab, taken)
+            taken.update(canonicalize_url(article['link']) for article in tab_news)
+            print(f"Selected {len(tab_news)} news articles for {tab}.")
+            selected.extend(tab_news)
+        # Articles the interrupted run already wrote still count towards NEWS_COUNT but are not redone
+        return selected, [article for article in selected if not reached(run_state.get(article['link']), 'written')]
+
+    news, pending = select_news()
+    if run_state.resumed and not pending:
+        print(f"Run {run_state.run_id} has nothing left to do; starting a new run.")
+        run_state.finish()
+        run_state.start()
+        news, pending = select_news()
+    if not news:
+        print("No news articles found in the configured feeds.")
+        run_state.finish()
+        return
+    if not pending:
+        print("No news articles left to process.")
+        run_state.finish()
+        return
+    news = pending
+    published_as.update((article['link'], (article['title'], article['source'])) for article in news)
+    related.update((article['link'], article['related']) for article in news)
+
+    # Created before the workers start, so they all share one cache and one set of in-flight lookups
+    get_youtube_search_cache()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as article_executor:
+        futures = {article_executor.submit(process_article, article, run_state): article for article in news}
+
+        # Rows are queued in feed order as soon as each article (and every one before it) is done;
+        # in streaming mode each row is written the moment its article finishes
+        try:
+            for future in (as_completed(futures) if STREAMING_MODE else futures):
+                try:
+                    row_data = future.result()
+                except Exception as e:
+                    print(f"Error processing article '{futures[future]['title']}': {e}")
+                    continue
+                sheet_writer_for(futures[future]['tab']).add(row_data)
+        finally:
+            for sheet_writer in sheet_writers.values():
+                sheet_writer.flush()
 
+    if all(reached(run_state.get(article['link']), 'written') for article in news):
+        run_state.finish()
+    else:
+        print(f"Run {run_state.run_id} did not write every article; continue it with --resume.")
 
 # def detect_ai_content(text):
 #     try:
-#         response = openai_client.chat.completions.create(
+#         response = get_openai_client().chat.completions.create(
 #             model="gpt-3.5-turbo",
 #             messages=[
 #                 {"role": "system", "content": "You are an AI content detector. Analyze the given text and estimate the likelihood it was generated by AI. Respond with only a percentage between 0 and 100, without any additional text."},
@@ -317,7 +1724,7 @@ def get_top_news():
 
 # def humanize_content(text):
 #     try:
-#         response = anthropic_client.messages.create(
+#         response = get_anthropic_client().messages.create(
 #             model="claude-3-sonnet-20240229",
 #             max_tokens=1500,
 #             temperature=0.7,
@@ -332,4 +1739,4 @@ def get_top_news():
 #         return text  # Return original text if humanization fails
 
 if __name__ == "__main__":
-    get_top_news()
+    get_top_news(resume=RESUME_MODE or '--resume' in sys.argv[1:])